@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+from generator import Data_generator, Database_Writer, FIRST_MACHINE_ID, axis, create_sink, insert_to_axis, machine_data
+from runner import split_machine_ids
+from sinks import SINKS
+
+
+# runs the generator -> writer pipeline for a fixed time and prints the results as json, e.g.
+#   python3 benchmark.py --sink memory --machines 10000 --duration 30
+#   python3 benchmark.py --sink postgres --batch-size 20000 --concurrency 4
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p90, p99 = np.percentile(np.asarray(values), [50, 90, 99])
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values), 'count': len(values)}
+
+
+async def produce(machine_ids, generator, data_base_writer, deadline, interval, vectorized):
+    # ticks for one slice of the fleet until the deadline, back to back when interval is 0
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while loop.time() < deadline:
+        await insert_to_axis(machine_ids, generator, data_base_writer, vectorized=vectorized)
+        next_tick += interval
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+
+async def run_benchmark(args):
+    machine_ids = list(range(args.first_machine_id, args.first_machine_id + args.machines))
+    generator = Data_generator(seed=args.seed)
+    # the sqlite sink defaults to an in-memory database here, not to a file like in generator.py
+    sink = create_sink(args.sink, args.sink_path or (':memory:' if args.sink == 'sqlite' else None), pool_size=args.pool_size)
+    data_base_writer = Database_Writer(batch_size=args.batch_size or None, max_batch_age=args.max_batch_age, sink=sink)
+    await data_base_writer.connect_db()
+
+    # the topology is written before the clock starts
+    await machine_data(machine_ids, generator, data_base_writer)
+    await axis(machine_ids, generator, data_base_writer)
+    await data_base_writer.load_topology()
+    rows_before = data_base_writer.stats.rows_written
+    sink.pool_wait_seconds.clear()
+
+    loop = asyncio.get_running_loop()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    deadline = loop.time() + args.duration
+    await asyncio.gather(*(
+        produce(shard, generator, data_base_writer, deadline, args.interval, not args.per_value)
+        for shard in split_machine_ids(machine_ids, args.concurrency) if shard
+    ))
+    # the final flush is part of the run
+    await data_base_writer.close()
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+
+    stats = data_base_writer.stats
+    rows = stats.rows_written - rows_before
+    return {
+        'config': {
+            'sink': args.sink,
+            'machines': args.machines,
+            'duration': args.duration,
+            'batch_size': args.batch_size,
+            'concurrency': args.concurrency,
+            'interval': args.interval,
+            'vectorized': not args.per_value,
+        },
+        'rows': rows,
+        'elapsed_seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+        'ticks': stats.ticks,
+        'rows_dropped': stats.rows_dropped,
+        'flushes': stats.flushes,
+        'flush_latency_seconds': percentiles(list(stats.flush_seconds)),
+        'pool_wait_seconds': percentiles(list(sink.pool_wait_seconds)),
+        'pool_wait_total_seconds': float(sum(sink.pool_wait_seconds)),
+        # cpu of this process only, the database server is not included
+        'cpu_seconds': cpu,
+        'cpu_microseconds_per_row': cpu / rows * 1e6 if rows else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure generator / writer ingest throughput")
+    parser.add_argument("--sink", choices=SINKS, default="memory")
+    parser.add_argument("--sink-path", default=None, help="sqlite database file or parquet / arrow directory")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to produce data for")
+    parser.add_argument("--machines", type=int, default=1000)
+    parser.add_argument("--first-machine-id", type=int, default=FIRST_MACHINE_ID)
+    parser.add_argument("--batch-size", type=int, default=5000, help="axis samples per flush, 0 writes row by row")
+    parser.add_argument("--max-batch-age", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=1, help="producer tasks, each with a slice of the fleet")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between ticks, 0 runs flat out")
+    parser.add_argument("--per-value", action="store_true", help="use the per value generator instead of numpy ticks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # keep stdout for the json report
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run_benchmark(args))
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,34 @@
 import asyncpg
 import asyncio
+import argparse
 import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
 
-# Database connection details
-DB_HOST = "localhost"
-DB_NAME = "machine_info"  
-DB_USER = "shiva"        
-DB_PASS = "password"    
-DB_PORT = 5432  
+# Database connection details, can be overridden with environment variables of the same name
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_NAME = os.environ.get("DB_NAME", "machine_info")
+DB_USER = os.environ.get("DB_USER", "shiva")
+DB_PASS = os.environ.get("DB_PASS", "password")
+DB_PORT = int(os.environ.get("DB_PORT", 5432))
+
+# axis_data is range partitioned on update_timestamp, one partition per day (or hour)
+PARTITION_GRANULARITY = "day"
+PARTITIONS_AHEAD = 3                      # partitions created in advance
+AXIS_DATA_RETENTION = timedelta(days=30)  # partitions older than this are dropped by --maintain
+
+# rollups of axis_data: bucket width and how long buckets are kept (None keeps them forever)
+ROLLUPS = {
+    "1s": ("1 second", timedelta(days=30)),
+    "10s": ("10 seconds", timedelta(days=180)),
+    "1m": ("1 minute", None),
+}
+ROLLUP_FIELDS = ["actual_position", "velocity", "acceleration"]
 
 logging.basicConfig(level=logging.INFO)
 
-async def create_tables():
+async def create_tables(granularity=PARTITION_GRANULARITY, ahead=PARTITIONS_AHEAD):
     # Connect to the database
     conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
     
@@ -54,9 +71,11 @@ async def create_tables():
     );
     """
     
+    # partitioned by update_timestamp, old data is removed by dropping whole partitions.
+    # the primary key of a partitioned table has to include the partition key
     create_axis_data_table = """
     CREATE TABLE IF NOT EXISTS axis_data (
-        axis_data_id SERIAL PRIMARY KEY,  
+        axis_data_id SERIAL,  
         axis_id INT REFERENCES axis(axis_id) ON DELETE CASCADE,  
         actual_position DECIMAL(10, 3) NOT NULL, 
         target_position DECIMAL(10, 3) NOT NULL,  
@@ -64,16 +83,56 @@ async def create_tables():
         homed BOOLEAN NOT NULL,  
         acceleration DECIMAL(10, 3) NOT NULL, 
         velocity DECIMAL(10, 3) NOT NULL, 
-        update_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP  
-    );
+        update_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (axis_data_id, update_timestamp)
+    ) PARTITION BY RANGE (update_timestamp);
+    """
+
+    # catches rows outside the pre-created partitions, should stay (almost) empty
+    create_axis_data_default_partition = """
+    CREATE TABLE IF NOT EXISTS axis_data_default PARTITION OF axis_data DEFAULT;
     """
     
     create_index_axis_machine_id = """
     CREATE INDEX IF NOT EXISTS idx_axis_machine_id ON axis (machine_id);
     """
     
-    create_index_axis_data_axis_id = """
-    CREATE INDEX IF NOT EXISTS idx_axis_data_axis_id ON axis_data (axis_id);
+    # newest first pages of the tool history (see user_management/pagination.py), per machine and fleet wide.
+    # the primary key is the tie breaker of the page order
+    create_index_tool_machine_id_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_tool_machine_id_timestamp ON tool (machine_id, update_timestamp, tool_id);
+    """
+
+    create_index_tool_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_tool_timestamp ON tool (update_timestamp, tool_id);
+    """
+
+    create_index_tool_usage_machine_id_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_tool_usage_machine_id_timestamp ON tool_usage (machine_id, update_timestamp, usage_id);
+    """
+
+    create_index_tool_usage_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_tool_usage_timestamp ON tool_usage (update_timestamp, usage_id);
+    """
+
+    # time window queries per axis, also covers lookups by axis_id alone. Like for tool and tool_usage
+    # the primary key is the tie breaker of the history pages, per machine (axis_id IN ...) and fleet wide.
+    # replaces idx_axis_data_axis_id_timestamp, which is its prefix
+    create_index_axis_data_axis_id_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_axis_data_axis_id_timestamp_id ON axis_data (axis_id, update_timestamp, axis_data_id);
+    """
+
+    drop_index_axis_data_axis_id_timestamp = """
+    DROP INDEX IF EXISTS idx_axis_data_axis_id_timestamp;
+    """
+
+    create_index_axis_data_timestamp = """
+    CREATE INDEX IF NOT EXISTS idx_axis_data_timestamp ON axis_data (update_timestamp, axis_data_id);
+    """
+
+    # small index for fleet wide time ranges, rows are inserted in time order
+    create_index_axis_data_timestamp_brin = """
+    CREATE INDEX IF NOT EXISTS idx_axis_data_timestamp_brin ON axis_data USING BRIN (update_timestamp);
     """
 
     # Execute the SQL commands
@@ -82,13 +141,268 @@ async def create_tables():
     await conn.execute(create_tool_usage_table)
     await conn.execute(create_axis_table)
     await conn.execute(create_axis_data_table)
+    partitioned = await axis_data_partitioned(conn)
+    if partitioned:
+        await conn.execute(create_axis_data_default_partition)
     await conn.execute(create_index_axis_machine_id)
-    await conn.execute(create_index_axis_data_axis_id)
+    await conn.execute(create_index_tool_machine_id_timestamp)
+    await conn.execute(create_index_tool_timestamp)
+    await conn.execute(create_index_tool_usage_machine_id_timestamp)
+    await conn.execute(create_index_tool_usage_timestamp)
+    await conn.execute(create_index_axis_data_axis_id_timestamp)
+    await conn.execute(drop_index_axis_data_axis_id_timestamp)
+    await conn.execute(create_index_axis_data_timestamp)
+    await conn.execute(create_index_axis_data_timestamp_brin)
+    if partitioned:
+        await create_partitions(conn, granularity, ahead)
+    await create_state_tables(conn)
+    await create_rollup_tables(conn)
 
     logging.info("Tables created successfully.")
     
     # Close the connection
     await conn.close()
 
+
+async def create_state_tables(conn):
+    # latest value per axis / machine, upserted by statement level triggers on the history tables.
+    # the triggers see every row of an INSERT or COPY at once, so the cost is one upsert per batch
+    create_axis_state_table = """
+    CREATE TABLE IF NOT EXISTS axis_state (
+        axis_id INT PRIMARY KEY REFERENCES axis(axis_id) ON DELETE CASCADE,
+        axis_data_id INT NOT NULL,
+        actual_position DECIMAL(10, 3) NOT NULL,
+        target_position DECIMAL(10, 3) NOT NULL,
+        distance_to_go DECIMAL(10, 3) NOT NULL,
+        homed BOOLEAN NOT NULL,
+        acceleration DECIMAL(10, 3) NOT NULL,
+        velocity DECIMAL(10, 3) NOT NULL,
+        update_timestamp TIMESTAMP NOT NULL
+    );
+    """
+
+    create_tool_state_table = """
+    CREATE TABLE IF NOT EXISTS tool_state (
+        machine_id INT PRIMARY KEY REFERENCES machine(machine_id) ON DELETE CASCADE,
+        tool_id INT NOT NULL,
+        tool_offset FLOAT NOT NULL,
+        feedrate FLOAT NOT NULL,
+        update_timestamp TIMESTAMP NOT NULL
+    );
+    """
+
+    create_tool_usage_state_table = """
+    CREATE TABLE IF NOT EXISTS tool_usage_state (
+        machine_id INT PRIMARY KEY REFERENCES machine(machine_id) ON DELETE CASCADE,
+        usage_id INT NOT NULL,
+        tool_in_use INT NOT NULL,
+        update_timestamp TIMESTAMP NOT NULL
+    );
+    """
+
+    # (history table, state table, key column, id column, value columns)
+    states = [
+        ("axis_data", "axis_state", "axis_id", "axis_data_id",
+         ["actual_position", "target_position", "distance_to_go", "homed", "acceleration", "velocity"]),
+        ("tool", "tool_state", "machine_id", "tool_id", ["tool_offset", "feedrate"]),
+        ("tool_usage", "tool_usage_state", "machine_id", "usage_id", ["tool_in_use"]),
+    ]
+
+    await conn.execute(create_axis_state_table)
+    await conn.execute(create_tool_state_table)
+    await conn.execute(create_tool_usage_state_table)
+
+    for history, state, key, row_id, values in states:
+        columns = ", ".join([key, row_id] + values + ["update_timestamp"])
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in [row_id] + values + ["update_timestamp"])
+        # newest row per key, older rows arriving late never overwrite a newer state
+        upsert = f"""
+        INSERT INTO {state} ({columns})
+        SELECT DISTINCT ON ({key}) {columns} FROM {{source}}
+        WHERE {key} IS NOT NULL AND update_timestamp IS NOT NULL
+        ORDER BY {key}, update_timestamp DESC, {row_id} DESC
+        ON CONFLICT ({key}) DO UPDATE SET {updates}
+        WHERE {state}.update_timestamp <= EXCLUDED.update_timestamp
+        """
+
+        await conn.execute(f"""
+        CREATE OR REPLACE FUNCTION update_{state}() RETURNS trigger AS $$
+        BEGIN
+            {upsert.format(source="new_rows")};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        await conn.execute(f"DROP TRIGGER IF EXISTS {history}_update_state ON {history};")
+        await conn.execute(f"""
+        CREATE TRIGGER {history}_update_state AFTER INSERT ON {history}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION update_{state}();
+        """)
+        # fill a new state table from the existing history once
+        if await conn.fetchval(f"SELECT NOT EXISTS (SELECT 1 FROM {state})"):
+            await conn.execute(upsert.format(source=history))
+
+
+async def create_rollup_tables(conn):
+    # min / max / sum / last per axis and bucket for every rollup in ROLLUPS. A statement level trigger
+    # aggregates each inserted batch and merges it into the existing buckets, averages are sum / samples
+    upserts = []
+    for name, (width, _) in ROLLUPS.items():
+        table = f"axis_data_rollup_{name}"
+        field_columns = "".join(
+            f"""
+            {field}_min DECIMAL(10, 3) NOT NULL,
+            {field}_max DECIMAL(10, 3) NOT NULL,
+            {field}_sum DOUBLE PRECISION NOT NULL,
+            {field}_last DECIMAL(10, 3) NOT NULL,"""
+            for field in ROLLUP_FIELDS
+        )
+        await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            axis_id INT REFERENCES axis(axis_id) ON DELETE CASCADE,
+            bucket TIMESTAMP NOT NULL,
+            samples INT NOT NULL,
+            last_timestamp TIMESTAMP NOT NULL,{field_columns}
+            PRIMARY KEY (axis_id, bucket)
+        );
+        """)
+
+        columns = ["axis_id", "bucket", "samples", "last_timestamp"]
+        aggregates = [f"date_bin('{width}', update_timestamp, TIMESTAMP '2000-01-01')", "count(*)", "max(update_timestamp)"]
+        merges = ["samples = r.samples + EXCLUDED.samples", "last_timestamp = GREATEST(r.last_timestamp, EXCLUDED.last_timestamp)"]
+        for field in ROLLUP_FIELDS:
+            columns += [f"{field}_min", f"{field}_max", f"{field}_sum", f"{field}_last"]
+            aggregates += [f"min({field})", f"max({field})", f"sum({field})",
+                           f"(array_agg({field} ORDER BY update_timestamp DESC))[1]"]
+            merges += [
+                f"{field}_min = LEAST(r.{field}_min, EXCLUDED.{field}_min)",
+                f"{field}_max = GREATEST(r.{field}_max, EXCLUDED.{field}_max)",
+                f"{field}_sum = r.{field}_sum + EXCLUDED.{field}_sum",
+                f"{field}_last = CASE WHEN EXCLUDED.last_timestamp >= r.last_timestamp THEN EXCLUDED.{field}_last ELSE r.{field}_last END",
+            ]
+        upserts.append(f"""
+            INSERT INTO {table} AS r ({", ".join(columns)})
+            SELECT axis_id, {", ".join(aggregates)}
+            FROM new_rows
+            WHERE axis_id IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (axis_id, bucket) DO UPDATE SET {", ".join(merges)};""")
+
+    await conn.execute(f"""
+    CREATE OR REPLACE FUNCTION update_axis_data_rollups() RETURNS trigger AS $$
+    BEGIN{"".join(upserts)}
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    await conn.execute("DROP TRIGGER IF EXISTS axis_data_update_rollups ON axis_data;")
+    await conn.execute("""
+    CREATE TRIGGER axis_data_update_rollups AFTER INSERT ON axis_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_axis_data_rollups();
+    """)
+
+
+async def expire_rollups(conn):
+    for name, (_, retention) in ROLLUPS.items():
+        if retention is None:
+            continue
+        result = await conn.execute(f"DELETE FROM axis_data_rollup_{name} WHERE bucket < $1;", utc_now() - retention)
+        logging.info(f"expired rollup {name} : {result}")
+
+
+def partition_start(timestamp, granularity):
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(start, granularity):
+    if granularity == "hour":
+        return f"axis_data_{start:%Y%m%d_%H}"
+    return f"axis_data_{start:%Y%m%d}"
+
+
+def utc_now():
+    # update_timestamp is stored as UTC without time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def axis_data_partitioned(conn):
+    # CREATE TABLE IF NOT EXISTS keeps an axis_data table created before partitioning, which is
+    # left as is (and has to be migrated by hand), without partitions to create or expire
+    partitioned = await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('axis_data')")
+    if not partitioned:
+        logging.warning("axis_data is not partitioned, skipping its partitions")
+    return bool(partitioned)
+
+
+async def create_partitions(conn, granularity, ahead):
+    # creates the current partition and the next `ahead` ones, existing partitions are left alone
+    step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    start = partition_start(utc_now(), granularity)
+    for _ in range(ahead + 1):
+        name = partition_name(start, granularity)
+        try:
+            await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF axis_data
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + step).isoformat()}');
+            """)
+        except asyncpg.PostgresError as e:
+            # usually rows for this range already landed in axis_data_default
+            logging.error(f"could not create partition {name} : {e}")
+        start += step
+    logging.info(f"axis_data partitions ready up to {start}")
+
+
+async def expire_partitions(conn, retention, detach=False):
+    # drops (or detaches, to archive them elsewhere) partitions whose upper bound is older than the retention
+    cutoff = utc_now() - retention
+    partitions = await conn.fetch("""
+    SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = 'axis_data'
+    """)
+    for partition in partitions:
+        # bound looks like FOR VALUES FROM ('2024-09-30 00:00:00') TO ('2024-10-01 00:00:00'), or DEFAULT
+        match = re.search(r"TO \('([^']+)'\)", partition['bound'])
+        if match is None or datetime.fromisoformat(match.group(1)) > cutoff:
+            continue
+        if detach:
+            await conn.execute(f"ALTER TABLE axis_data DETACH PARTITION {partition['name']};")
+            logging.info(f"detached partition {partition['name']}")
+        else:
+            await conn.execute(f"DROP TABLE {partition['name']};")
+            logging.info(f"dropped partition {partition['name']}")
+
+
+async def maintain_partitions(granularity, ahead, retention, detach):
+    # meant to be run periodically (e.g. from cron) at least once per partition interval
+    conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
+    try:
+        if await axis_data_partitioned(conn):
+            await create_partitions(conn, granularity, ahead)
+            await expire_partitions(conn, retention, detach)
+        await expire_rollups(conn)
+    finally:
+        await conn.close()
+
+
 if __name__ == "__main__":
-    asyncio.run(create_tables())
+    parser = argparse.ArgumentParser(description="create the database schema or maintain axis_data partitions")
+    parser.add_argument("--maintain", action="store_true", help="create upcoming partitions and expire old ones")
+    parser.add_argument("--granularity", choices=["day", "hour"], default=PARTITION_GRANULARITY,
+                        help="partition size, keep it the same for the lifetime of the table")
+    parser.add_argument("--ahead", type=int, default=PARTITIONS_AHEAD, help="partitions to create in advance")
+    parser.add_argument("--retention-days", type=float, default=AXIS_DATA_RETENTION.days,
+                        help="partitions older than this are dropped")
+    parser.add_argument("--detach", action="store_true", help="detach expired partitions instead of dropping them")
+    args = parser.parse_args()
+
+    if args.maintain:
+        asyncio.run(maintain_partitions(args.granularity, args.ahead, timedelta(days=args.retention_days), args.detach))
+    else:
+        asyncio.run(create_tables(args.granularity, args.ahead))
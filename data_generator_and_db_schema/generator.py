@@ -1,28 +1,74 @@
-import asyncpg
+import argparse
+import collections
+import itertools
+import numpy as np
+import os
 import random
 import sys
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 import asyncio
+from functools import partial
+from scheduler import Tick_Scheduler
+from sinks import SINKS, make_sink
+from topology import Topology_Registry
 logging.basicConfig(level=logging.INFO)
 
 
-DB_HOST = "localhost"
-DB_NAME = "machine_info"  
-DB_USER = "shiva"        
-DB_PASS = "password"    
-DB_PORT = 5432  
+# database connection details, can be overridden with environment variables of the same name
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_NAME = os.environ.get("DB_NAME", "machine_info")
+DB_USER = os.environ.get("DB_USER", "shiva")
+DB_PASS = os.environ.get("DB_PASS", "password")
+DB_PORT = int(os.environ.get("DB_PORT", 5432))
 
+# where the generated data goes (postgres, sqlite, parquet, arrow or memory, see sinks.py), --sink overrides it.
+# DATA_SINK_PATH is the database file of the sqlite sink and the output directory of the file sinks
+DATA_SINK = os.environ.get("DATA_SINK", "postgres")
+DATA_SINK_PATH = os.environ.get("DATA_SINK_PATH")
+DEFAULT_SINK_PATHS = {'sqlite': 'machine_info.sqlite3', 'parquet': 'machine_data', 'arrow': 'machine_data'}
+
+# machine ids of the simulated fleet start here
+FIRST_MACHINE_ID = 81258856
+
+# UPDATE INTERVAL of every field in seconds, as given in the field specification
+UPDATE_INTERVALS = {
+    'tool_offset': 10,
+    'feedrate': 10,
+    'tool_in_use': 5,
+    'actual_position': 0.01,
+    'target_position': 0.01,
+    'homed': 0.01,
+    'acceleration': 0.01,
+    'velocity': 0.01,
+}
+
+# fields written together, a group is updated at the shortest interval of its fields
+FIELD_GROUPS = {
+    'tool': ['tool_offset', 'feedrate'],
+    'tool_usage': ['tool_in_use'],
+    'axis_data': ['actual_position', 'target_position', 'homed', 'acceleration', 'velocity'],
+}
+
+# column order used when axis samples are copied in batches
+AXIS_DATA_COLUMNS = ['axis_id', 'actual_position', 'target_position', 'homed', 'acceleration', 'velocity', 'update_timestamp']
+
+
+def utc_now():
+    # update_timestamp columns are TIMESTAMP without time zone and are read back as UTC by the api
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class Data_generator:
-    def __init__(self):
+    def __init__(self, seed=None):
     # Declaring these values here as they are constant & also can be taken by input when required    
         self._max_acceleration = 200
         self._max_velocity     = 60
         self._axes_names  = ['X', 'Y', 'Z', 'A', 'C']
         self._tool_capacity = 24   
+        # used by the vectorized fleet ticks, a fixed seed gives reproducible runs
+        self._rng = np.random.default_rng(seed)
 
     async def generate_tool_data(self, machine_id):
         tool_offset = random.uniform(5, 40) 
@@ -40,152 +86,360 @@ class Data_generator:
         acceleration = random.uniform(0, 150)
         velocity = random.uniform(0, 80)
 
-        #return (axis_name, actual_position, target_position, homed, acceleration, velocity)
+        #return (axis_name, actual_position, target_position, homed, acceleration, velocity, update_timestamp)
         return [
         axis_name,
         float(actual_position),
         float(target_position),
         bool(homed),
         float(acceleration),
-        float(velocity)
+        float(velocity),
+        utc_now()
     ]
 
+    def generate_fleet_tick(self, machine_ids):
+        # axis data for every machine and axis in one call, as columns of len(machine_ids) * len(axes)
+        # values ordered machine by machine, axes in self._axes_names order. All rows of a tick share its timestamp
+        n = len(machine_ids) * len(self._axes_names)
+        rng = self._rng
+        return {
+            'actual_position': rng.uniform(-190, 190, n),
+            'target_position': rng.uniform(-190, 191, n),
+            'homed': rng.random(n) < 0.5,
+            'acceleration': rng.uniform(0, 150, n),
+            'velocity': rng.uniform(0, 80, n),
+            'update_timestamp': utc_now(),
+        }
 
-class Database_Writer:
+
+class Ingest_Stats:
+    # counters read by the runner / benchmark while the writer is running
     def __init__(self):
-        self._pool = None
+        self.rows_written = 0
+        self.flushes = 0
+        self.ticks = 0
+        self.rows_dropped = 0   # axis samples given up on after max_flush_retries failed flushes
+        self.flush_seconds = collections.deque(maxlen=100000)   # duration of the most recent flushes
+
+    def snapshot(self):
+        return {'rows_written': self.rows_written, 'rows_dropped': self.rows_dropped, 'flushes': self.flushes, 'ticks': self.ticks}
+
+
+class Database_Writer:
+    def __init__(self, batch_size=None, max_batch_age=1.0, topology=None, pool_size=10, sink=None, max_flush_retries=3):
+        # where the rows go, see sinks.py
+        self.sink = sink if sink is not None else create_sink(DATA_SINK, DATA_SINK_PATH, pool_size=pool_size)
+        self._connected = False
+        self.stats = Ingest_Stats()
+        self.topology = topology if topology is not None else Topology_Registry()
+        self._topology_loaded_at = None
+        # with batch_size set, axis samples are buffered and copied to the database once
+        # batch_size rows are collected or the oldest buffered row is max_batch_age seconds old.
+        # batch_size=None keeps the row by row inserts
+        self._batch_size = batch_size
+        self._max_batch_age = max_batch_age
+        self._axis_buffer = []
+        self._column_buffer = []     # (axis_ids, columns) chunks from vectorized fleet ticks
+        self._buffered_rows = 0
+        self._buffer_started = None
+        self._flush_task = None
+        # a batch that fails to write goes back into the buffer and is retried with the next
+        # flush, at the earliest max_batch_age seconds later. After max_flush_retries failures in
+        # a row the buffer is dropped. Failures are logged, the producers keep running
+        self._max_flush_retries = max_flush_retries
+        self._failed_flushes = 0
+        self._retry_at = 0.0
+        self._axis_id_arrays = {}
     
     async def connect_db(self):
         try:
-            self._pool = await asyncpg.create_pool(database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
-            logging.info('connected to database')
+            await self.sink.connect()
+            self._connected = True
+            logging.info(f'connected to {type(self.sink).__name__}')
         except Exception as e:
             logging.warning(f'error connecting to database :  {e}')
-            
+            return
+        if self._batch_size:
+            self._flush_task = asyncio.create_task(self._flush_aged_batches())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._connected:
+            # retried right away until written or dropped
+            while self._buffered_rows:
+                await self.flush_axis_data(force=True)
+            await self.sink.close()
+            self._connected = False
+
+    def lag(self):
+        # seconds the oldest sample not yet written has been waiting
+        if self._buffer_started is None:
+            return 0.0
+        return time.monotonic() - self._buffer_started
+
+    async def load_topology(self):
+        machines, axes = await self.sink.fetch_topology()
+        self.topology.load_rows(machines, axes)
+        logging.info(f"loaded topology for {len(machines)} machines and {len(axes)} axes")
+        self._topology_loaded_at = time.monotonic()
+        self._axis_id_arrays = {}
+
+    def _topology_reload_due(self):
+        # an unknown axis may have been added after startup (e.g. through the api), reload at most once a second
+        return self._topology_loaded_at is None or time.monotonic() - self._topology_loaded_at > 1
+
+    async def _resolve_axis_id(self, machine_id, axis_name):
+        axis_id = self.topology.axis_id(machine_id, axis_name)
+        if axis_id is None and self._topology_reload_due():
+            await self.load_topology()
+            axis_id = self.topology.axis_id(machine_id, axis_name)
+        return axis_id
     
     async def insert_machine_data(self, machine_id, machine_name, tool_capacity):
-        async with self._pool.acquire() as connection:
-            await connection.execute("""
-            INSERT INTO machine (machine_id, machine_name, tool_capacity)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (machine_id) DO NOTHING
-        """, machine_id, machine_name, tool_capacity)
+        await self.sink.write_rows('machine', ['machine_id', 'machine_name', 'tool_capacity'],
+                                   [(machine_id, machine_name, tool_capacity)], ignore_conflicts=True)
 
     async def insert_tool_data(self, tool_data):
-        async with self._pool.acquire() as connection:
-            await connection.execute("""
-            INSERT INTO tool (machine_id, tool_offset, feedrate)
-            VALUES ($1, $2, $3)
-        """, tool_data[0], tool_data[1], tool_data[2] )
+        await self.sink.write_rows('tool', ['machine_id', 'tool_offset', 'feedrate'], [tuple(tool_data)])
         
     async def insert_tool_in_use(self, data):
-        async with self._pool.acquire() as connection:
-            await connection.execute("""
-            INSERT INTO tool_usage (machine_id, tool_in_use)
-        VALUES ($1, $2)
-        """, data[0], data[1])
+        await self.sink.write_rows('tool_usage', ['machine_id', 'tool_in_use'], [tuple(data)])
     
     async def insert_axis(self, machine_id, axis_name, max_acceleration, max_velocity):
-        async with self._pool.acquire() as connection:
-            await connection.execute("""
-            INSERT INTO axis (machine_id, axis_name, max_acceleration, max_velocity)
-            VALUES ($1, $2, $3, $4)
-            ON CONFLICT (machine_id, axis_name) DO NOTHING
-        """, machine_id, axis_name, max_acceleration, max_velocity) 
+        await self.sink.write_rows('axis', ['machine_id', 'axis_name', 'max_acceleration', 'max_velocity'],
+                                   [(machine_id, axis_name, max_acceleration, max_velocity)], ignore_conflicts=True)
 
     async def insert_axis_data(self, machine_id, axis_name, axis_data):
-        async with self._pool.acquire() as connection:
-            axis_id_row = await connection.fetchrow("""
-                SELECT axis_id FROM axis WHERE machine_id = $1 AND axis_name = $2
-            """, machine_id, axis_name)
+        if self._batch_size:
+            if not self._buffered_rows:
+                self._buffer_started = time.monotonic()
+            self._axis_buffer.append((machine_id, axis_name, axis_data))
+            self._buffered_rows += 1
+            if self._buffered_rows >= self._batch_size:
+                await self.flush_axis_data()
+            return
+
+        axis_id = await self._resolve_axis_id(machine_id, axis_name)
+
+        # Check if we retrieved an axis_id
+        if axis_id is None:
+            logging.error(f"Axis with machine_id {machine_id} and axis_name {axis_name} not found.")
+            return  # Exit if the axis_id doesn't exist
+
+        self.stats.rows_written += await self.sink.write_rows('axis_data', AXIS_DATA_COLUMNS, [(axis_id, *axis_data[1:])])
+
+    async def insert_axis_columns(self, machine_ids, axis_names, columns):
+        # columnar counterpart of insert_axis_data for Data_generator.generate_fleet_tick
+        axis_ids = await self._resolve_axis_id_array(machine_ids, axis_names)
+        if not self._buffered_rows:
+            self._buffer_started = time.monotonic()
+        self._column_buffer.append((axis_ids, columns))
+        self._buffered_rows += len(axis_ids)
+        if not self._batch_size or self._buffered_rows >= self._batch_size:
+            await self.flush_axis_data()
+
+    async def _resolve_axis_id_array(self, machine_ids, axis_names):
+        # axis ids in fleet tick order, -1 for unknown axes. cached as the fleet rarely changes, per
+        # machine_ids list: a shard ticks with the same list, which is not changed while it runs, so
+        # the key does not depend on the size of the fleet
+        key = (id(machine_ids), tuple(axis_names))
+        cached = self._axis_id_arrays.get(key)   # (machine_ids, axis_ids, all axes known)
+        # arrays with unknown axes are resolved again once the topology may be reloaded,
+        # load_topology clears the cache
+        if cached is not None and cached[0] is machine_ids and (cached[2] or not self._topology_reload_due()):
+            return cached[1]
+        ids = [await self._resolve_axis_id(machine_id, axis_name) for machine_id in machine_ids for axis_name in axis_names]
+        axis_ids = np.array([-1 if axis_id is None else axis_id for axis_id in ids], dtype=np.int64)
+        unknown = int((axis_ids < 0).sum())
+        if unknown:
+            logging.error(f"{unknown} axes of the fleet not found, their samples are dropped.")
+        self._axis_id_arrays[key] = (machine_ids, axis_ids, not unknown)
+        return axis_ids
+
+    async def flush_axis_data(self, force=False):
+        if not self._buffered_rows or (not force and time.monotonic() < self._retry_at):
+            return
+        # swap the buffers first so samples generated while copying go to the next batch
+        buffered, self._axis_buffer = self._axis_buffer, []
+        column_chunks, self._column_buffer = self._column_buffer, []
+        buffered_rows, self._buffered_rows = self._buffered_rows, 0
+        buffer_started, self._buffer_started = self._buffer_started, None
 
-            # Check if we retrieved an axis_id
-            if axis_id_row is None:
+        records = []
+        for machine_id, axis_name, axis_data in buffered:
+            axis_id = await self._resolve_axis_id(machine_id, axis_name)
+            if axis_id is None:
                 logging.error(f"Axis with machine_id {machine_id} and axis_name {axis_name} not found.")
-                return  # Exit if the axis_id doesn't exist
+                continue
+            records.append((axis_id, *axis_data[1:]))
+        records = itertools.chain(records, *(column_records(axis_ids, columns) for axis_ids, columns in column_chunks))
+
+        started = time.perf_counter()
+        try:
+            self.stats.rows_written += await self.sink.write_rows('axis_data', AXIS_DATA_COLUMNS, records)
+        except Exception as e:
+            self._failed_flushes += 1
+            if self._failed_flushes > self._max_flush_retries:
+                self._failed_flushes = 0
+                self.stats.rows_dropped += buffered_rows
+                logging.error(f"dropped {buffered_rows} axis samples after {self._max_flush_retries + 1} failed flushes : {e}")
+            else:
+                # back in front of the samples buffered meanwhile, the next flush writes them again
+                self._axis_buffer[:0] = buffered
+                self._column_buffer[:0] = column_chunks
+                self._buffered_rows += buffered_rows
+                self._buffer_started = buffer_started
+                self._retry_at = time.monotonic() + self._max_batch_age
+                logging.error(f"error flushing {buffered_rows} axis samples, retrying : {e}")
+            return
+        self._failed_flushes = 0
+        self._retry_at = 0.0
+        self.stats.flush_seconds.append(time.perf_counter() - started)
+        self.stats.flushes += 1
+
+    async def _flush_aged_batches(self):
+        # flushes buffers that did not fill up within max_batch_age, e.g. for small fleets
+        while True:
+            await asyncio.sleep(self._max_batch_age / 2)
+            if self._buffer_started is not None and time.monotonic() - self._buffer_started >= self._max_batch_age:
+                await self.flush_axis_data()
+
+
 
-            axis_id = axis_id_row['axis_id']
+def create_sink(name, path=None, pool_size=10):
+    # sink from the configuration, path defaults per sink
+    if name == 'postgres':
+        return make_sink('postgres', database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT,
+                         pool_size=pool_size)
+    if name in DEFAULT_SINK_PATHS:
+        return make_sink(name, path=path or DEFAULT_SINK_PATHS[name])
+    return make_sink(name)
 
-            await connection.execute("""
-            INSERT INTO axis_data (axis_id, actual_position, target_position, homed, acceleration, velocity)
-            VALUES ($1, $2, $3, $4, $5, $6)
-        """, axis_id, axis_data[1], axis_data[2], axis_data[3], axis_data[4], axis_data[5] )
-            
+
+def column_records(axis_ids, columns):
+    # turns a fleet tick into records in AXIS_DATA_COLUMNS order, skipping unknown axes
+    known = axis_ids >= 0
+    if not known.all():
+        axis_ids = axis_ids[known]
+        columns = {name: values if name == 'update_timestamp' else values[known] for name, values in columns.items()}
+    return zip(
+        axis_ids.tolist(),
+        columns['actual_position'].tolist(),
+        columns['target_position'].tolist(),
+        columns['homed'].tolist(),
+        columns['acceleration'].tolist(),
+        columns['velocity'].tolist(),
+        itertools.repeat(columns['update_timestamp'], len(axis_ids)),
+    )
 
 
-async def machine_data(no_of_machines, generator, data_base_writer):
+async def machine_data(machine_ids, generator, data_base_writer):
     # writing to machine table at start and once cause they dont update frequently
     
-    for machine_id in range(81258856, 81258856 + no_of_machines):
+    for machine_id in machine_ids:
         await data_base_writer.insert_machine_data(machine_id=machine_id, machine_name=str(machine_id), tool_capacity=generator._tool_capacity)
-    logging.info(f"inserted machine info for {no_of_machines} machines")
+    logging.info(f"inserted machine info for {len(machine_ids)} machines")
 
     
-async def axis(no_of_machines, generator, data_base_writer):
+async def axis(machine_ids, generator, data_base_writer):
     # writing to machine table at start and once cause they dont update frequently
-    for machine_id in range(81258856, 81258856 + no_of_machines):
+    for machine_id in machine_ids:
         for axis_name in generator._axes_names:
             await data_base_writer.insert_axis(machine_id, axis_name, generator._max_acceleration, generator._max_velocity)
-    logging.info(f"inserted axis info for {no_of_machines} machines")
+    logging.info(f"inserted axis info for {len(machine_ids)} machines")
         
 
-async def tool_data(interval, no_of_machines, generator, data_base_writer):
-    try:
-        while True:
-            for machine_id in range(81258856, 81258856 + no_of_machines):
-                data = await generator.generate_tool_data(machine_id)
-                await data_base_writer.insert_tool_data(data)
-            logging.info("inserterd to tool_data")
-            await asyncio.sleep(interval)
-    except KeyboardInterrupt:
-            pass
+async def tool_data(machine_ids, generator, data_base_writer):
+    # one tick of tool data
+    for machine_id in machine_ids:
+        data = await generator.generate_tool_data(machine_id)
+        await data_base_writer.insert_tool_data(data)
+    logging.info("inserterd to tool_data")
     
-async def tool_in_use(interval, no_of_machines, generator, data_base_writer):
-    try:
-        while True:
-            for machine_id in range(81258856, 81258856 + no_of_machines):
-                data = await generator.generate_tool_in_use(machine_id)
-                await data_base_writer.insert_tool_in_use(data)
-            logging.info("inserterd to tool_in_use")
-            await asyncio.sleep(interval)
-    except KeyboardInterrupt:
-            pass
+async def tool_in_use(machine_ids, generator, data_base_writer):
+    # one tick of tool usage
+    for machine_id in machine_ids:
+        data = await generator.generate_tool_in_use(machine_id)
+        await data_base_writer.insert_tool_in_use(data)
+    logging.info("inserterd to tool_in_use")
         
 
-async def insert_to_axis(interval, no_of_machines, generator, data_base_writer):
-    count = 0
-    start_time = time.time()
-    try:
-        while True:
-            for machine_id in range(81258856, 81258856 + no_of_machines):
-                for axis_name in generator._axes_names:
-                    data = await generator.generate_axis_data(axis_name)
-                    await data_base_writer.insert_axis_data(machine_id, axis_name, data)
-            logging.info("inserterd to axis")
-            count+=1
-            if time.time() - start_time >1 :
-                logging.info(f'no of insert for second {count}')
-                count = 0
-                start_time = time.time()
-            await asyncio.sleep(interval)
-    except KeyboardInterrupt:
-            logging.error(f'ctrl-c : stopped inserting')
-        
-        
+async def insert_to_axis(machine_ids, generator, data_base_writer, vectorized=False):
+    # one tick of axis data
+    if vectorized:
+        # whole fleet tick as numpy columns
+        columns = generator.generate_fleet_tick(machine_ids)
+        await data_base_writer.insert_axis_columns(machine_ids, generator._axes_names, columns)
+    else:
+        for machine_id in machine_ids:
+            for axis_name in generator._axes_names:
+                data = await generator.generate_axis_data(axis_name)
+                await data_base_writer.insert_axis_data(machine_id, axis_name, data)
+    data_base_writer.stats.ticks += 1
 
-async def main():
-    no_of_machines = 20
-    generator = Data_generator()
-    data_base_writer = Database_Writer()
+
+def group_interval(group):
+    return min(UPDATE_INTERVALS[field] for field in FIELD_GROUPS[group])
+
+
+def fleet_scheduler(args, machine_ids, generator, data_base_writer):
+    # each field group runs on its own deadlines, groups with the same interval share a tick
+    scheduler = Tick_Scheduler(policy=args.policy, report_interval=args.report_interval)
+    scheduler.add('tool', group_interval('tool'), partial(tool_data, machine_ids, generator, data_base_writer))
+    scheduler.add('tool_usage', group_interval('tool_usage'), partial(tool_in_use, machine_ids, generator, data_base_writer))
+    scheduler.add('axis_data', group_interval('axis_data'), partial(insert_to_axis, machine_ids, generator, data_base_writer, vectorized=True))
+    return scheduler
+
+
+def add_fleet_arguments(parser):
+    # fleet and writer options shared by generator.py and runner.py
+    parser.add_argument("--machines", type=int, default=20, help="number of simulated machines")
+    parser.add_argument("--first-machine-id", type=int, default=FIRST_MACHINE_ID)
+    parser.add_argument("--batch-size", type=int, default=5000, help="axis samples per COPY, 0 writes row by row")
+    parser.add_argument("--max-batch-age", type=float, default=0.5, help="seconds before a partial batch is written")
+    parser.add_argument("--sink", choices=SINKS, default=DATA_SINK, help="where the data is written")
+    parser.add_argument("--sink-path", default=DATA_SINK_PATH, help="sqlite database file or parquet / arrow directory")
+    parser.add_argument("--pool-size", type=int, default=10, help="database connections per process")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible data")
+    parser.add_argument("--policy", choices=["skip", "catch_up"], default="skip", help="what to do with missed ticks")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between tick / throughput reports")
+    return parser
+
+
+def fleet_machine_ids(args):
+    return list(range(args.first_machine_id, args.first_machine_id + args.machines))
+
+
+def fleet_writer(args):
+    return Database_Writer(batch_size=args.batch_size or None, max_batch_age=args.max_batch_age,
+                           sink=create_sink(args.sink, args.sink_path, pool_size=args.pool_size))
+
+
+async def run_fleet(machine_ids, args, generator=None, data_base_writer=None, scheduler=None, extra_tasks=()):
+    # writes the topology of machine_ids and produces their data until cancelled
+    generator = generator or Data_generator(seed=args.seed)
+    data_base_writer = data_base_writer or fleet_writer(args)
+    scheduler = scheduler or fleet_scheduler(args, machine_ids, generator, data_base_writer)
     await data_base_writer.connect_db()
     
-    await asyncio.gather(
-        machine_data(no_of_machines, generator, data_base_writer),
-        axis(no_of_machines, generator, data_base_writer),
-        tool_data(10, no_of_machines, generator, data_base_writer), # pushes for every 15 minutes interval
-        tool_in_use(5, no_of_machines, generator, data_base_writer), # pushes for every 5 minutes interval
-        insert_to_axis(0.01, no_of_machines, generator, data_base_writer) # pushes for every 0.1 seconds interval
-    )
+    try:
+        # topology is written once and loaded before any samples are produced
+        await machine_data(machine_ids, generator, data_base_writer)
+        await axis(machine_ids, generator, data_base_writer)
+        await data_base_writer.load_topology()
+
+        await asyncio.gather(scheduler.run(), *extra_tasks)
+    finally:
+        # write out whatever is still buffered
+        await data_base_writer.close()
+
+
+async def main():
+    # single process, see runner.py to spread a large fleet over several processes
+    args = add_fleet_arguments(argparse.ArgumentParser(description="generate machine data")).parse_args()
+    await run_fleet(fleet_machine_ids(args), args)
     
     
 if __name__ == "__main__":
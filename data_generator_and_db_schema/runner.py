@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+from generator import Data_generator, add_fleet_arguments, fleet_machine_ids, fleet_scheduler, fleet_writer, run_fleet
+
+logging.basicConfig(level=logging.INFO)
+
+
+def split_machine_ids(machine_ids, shards):
+    # contiguous, near equal slices of the machine id space, one per shard
+    size, extra = divmod(len(machine_ids), shards)
+    slices, start = [], 0
+    for shard in range(shards):
+        end = start + size + (1 if shard < extra else 0)
+        slices.append(machine_ids[start:end])
+        start = end
+    return slices
+
+
+async def report_stats(shard, data_base_writer, scheduler, stats_queue, interval):
+    # lag is how late the ticks of the shard start, write lag how long samples wait in the writer buffer
+    while True:
+        await asyncio.sleep(interval)
+        stats_queue.put((shard, time.monotonic(), data_base_writer.stats.snapshot(), scheduler.max_lag(), data_base_writer.lag()))
+
+
+async def run_shard(shard, machine_ids, args, stats_queue):
+    # each shard has its own event loop, pool and generator seed
+    generator = Data_generator(seed=None if args.seed is None else args.seed + shard)
+    data_base_writer = fleet_writer(args)
+    scheduler = fleet_scheduler(args, machine_ids, generator, data_base_writer)
+    # ticks are reported once for the whole fleet by the coordinator
+    scheduler.report_interval = None
+    await run_fleet(machine_ids, args, generator, data_base_writer, scheduler,
+                    extra_tasks=[report_stats(shard, data_base_writer, scheduler, stats_queue, 1.0)])
+
+
+def shard_main(shard, machine_ids, args, stats_queue):
+    logging.info(f"shard {shard} started with {len(machine_ids)} machines (pid {os.getpid()})")
+    try:
+        asyncio.run(run_shard(shard, machine_ids, args, stats_queue))
+    except KeyboardInterrupt:
+        pass
+
+
+def coordinate(processes, stats_queue, report_interval):
+    # collects the per shard counters and logs throughput and lag until all shards exit
+    previous = {}   # shard -> (timestamp, rows_written)
+    current = {}    # shard -> (rows/s, tick lag, write lag)
+    dropped = {}    # shard -> axis samples dropped after failed flushes
+    last_report = time.monotonic()
+    while any(process.is_alive() for process in processes):
+        try:
+            shard, timestamp, stats, lag, write_lag = stats_queue.get(timeout=report_interval)
+        except queue.Empty:
+            continue
+        if shard in previous:
+            last_timestamp, last_rows = previous[shard]
+            current[shard] = ((stats['rows_written'] - last_rows) / (timestamp - last_timestamp), lag, write_lag)
+        previous[shard] = (timestamp, stats['rows_written'])
+        dropped[shard] = stats['rows_dropped']
+
+        if current and time.monotonic() - last_report >= report_interval:
+            last_report = time.monotonic()
+            total = sum(rate for rate, _, _ in current.values())
+            shards = ", ".join(f"{shard}: {rate:.0f} rows/s lag {lag * 1000:.0f}ms write lag {write_lag:.2f}s"
+                               for shard, (rate, lag, write_lag) in sorted(current.items()))
+            if sum(dropped.values()):
+                logging.warning(f"total {total:.0f} rows/s, {sum(dropped.values())} rows dropped | {shards}")
+            else:
+                logging.info(f"total {total:.0f} rows/s | {shards}")
+
+
+def main():
+    parser = add_fleet_arguments(argparse.ArgumentParser(description="generate machine data with one process per shard"))
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args()
+
+    shards = [machine_ids for machine_ids in split_machine_ids(fleet_machine_ids(args), max(1, args.shards)) if machine_ids]
+    context = multiprocessing.get_context("spawn")
+    stats_queue = context.Queue()
+    processes = [
+        context.Process(target=shard_main, args=(shard, machine_ids, args, stats_queue), name=f"shard-{shard}")
+        for shard, machine_ids in enumerate(shards)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        coordinate(processes, stats_queue, args.report_interval)
+    except KeyboardInterrupt:
+        logging.error('ctrl-c called, waiting for shards to flush')
+    finally:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
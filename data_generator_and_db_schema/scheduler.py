@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+
+class Tick_Stats:
+    def __init__(self):
+        self.ticks = 0
+        self.missed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def snapshot(self):
+        return {'ticks': self.ticks, 'missed': self.missed, 'last_lag': self.last_lag, 'max_lag': self.max_lag}
+
+
+class Tick_Scheduler:
+    # runs callbacks on absolute deadlines start + n * interval, so the period does not grow with the
+    # time the callbacks take. Callbacks registered with the same interval share one tick.
+    #
+    # when a tick overruns and later deadlines have already passed
+    #   policy 'skip'     continues with the next deadline in the future
+    #   policy 'catch_up' runs the late ticks back to back, at most max_catch_up of them
+    # deadlines that are never run are counted as missed, each one once. Late ticks that are
+    # caught up show in the lag instead
+    def __init__(self, policy='skip', max_catch_up=10, report_interval=10):
+        if policy not in ('skip', 'catch_up'):
+            raise ValueError(f"unknown policy {policy}")
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.report_interval = report_interval
+        self._groups = {}   # interval -> [(name, callback)]
+        self.stats = {}     # interval -> Tick_Stats
+
+    def add(self, name, interval, callback):
+        # callback is an async function without arguments
+        self._groups.setdefault(interval, []).append((name, callback))
+        self.stats.setdefault(interval, Tick_Stats())
+
+    def max_lag(self):
+        return max((stats.last_lag for stats in self.stats.values()), default=0.0)
+
+    async def run(self):
+        start = asyncio.get_running_loop().time()
+        tasks = [self._run_group(interval, callbacks, start) for interval, callbacks in self._groups.items()]
+        if self.report_interval:
+            tasks.append(self._report())
+        await asyncio.gather(*tasks)
+
+    async def _run_group(self, interval, callbacks, start):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[interval]
+        tick = 0
+        while True:
+            deadline = start + tick * interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            stats.last_lag = loop.time() - deadline
+            stats.max_lag = max(stats.max_lag, stats.last_lag)
+            await asyncio.gather(*(callback() for _, callback in callbacks))
+            stats.ticks += 1
+            tick += 1
+
+            # deadlines after the next one that have already passed
+            behind = int((loop.time() - (start + tick * interval)) // interval)
+            # tick only moves forward, the deadlines jumped over here are not looked at again
+            skipped = behind if self.policy == 'skip' else behind - self.max_catch_up
+            if skipped > 0:
+                stats.missed += skipped
+                tick += skipped
+
+    async def _report(self):
+        reported_missed = {}
+        while True:
+            await asyncio.sleep(self.report_interval)
+            for interval, callbacks in self._groups.items():
+                stats = self.stats[interval]
+                missed = stats.missed - reported_missed.get(interval, 0)
+                reported_missed[interval] = stats.missed
+                names = ", ".join(name for name, _ in callbacks)
+                message = (f"{names} every {interval}s: {stats.ticks} ticks, {missed} missed since last report, "
+                           f"lag {stats.last_lag * 1000:.1f}ms (max {stats.max_lag * 1000:.1f}ms)")
+                if missed:
+                    logging.warning(message)
+                else:
+                    logging.info(message)
@@ -0,0 +1,338 @@
+import abc
+import asyncio
+import collections
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+# only the sink that is used needs its library installed
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+SINKS = ['postgres', 'sqlite', 'parquet', 'arrow', 'memory']
+
+
+class Sink(abc.ABC):
+    # where Database_Writer sends its rows. records are tuples in the order of columns; they may be
+    # a list or any iterable that can be consumed once (large axis_data batches come as generators).
+    # machine and axis rows are written with ignore_conflicts=True and axis ids are assigned by the
+    # sink, like the SERIAL column of the database does
+    def __init__(self):
+        # seconds spent waiting for a connection (or the sink lock) per write, read by benchmark.py
+        self.pool_wait_seconds = collections.deque(maxlen=100000)
+
+    @abc.abstractmethod
+    async def connect(self):
+        pass
+
+    @abc.abstractmethod
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        # returns the number of rows written
+        pass
+
+    @abc.abstractmethod
+    async def fetch_topology(self):
+        # (machine rows, axis rows) as dicts, for Topology_Registry.load_rows
+        pass
+
+
+class Postgres_Sink(Sink):
+    # large batches go through COPY, single rows and conflict ignoring inserts through executemany
+    COPY_THRESHOLD = 32
+
+    CONFLICT_KEYS = {'machine': '(machine_id)', 'axis': '(machine_id, axis_name)'}
+
+    def __init__(self, database, user, password, host, port, pool_size=10):
+        if asyncpg is None:
+            raise RuntimeError("the postgres sink needs asyncpg, pip install asyncpg")
+        super().__init__()
+        self._connect_kwargs = dict(database=database, user=user, password=password, host=host, port=port)
+        self._pool_size = pool_size
+        self._pool = None
+
+    async def connect(self):
+        self._pool = await asyncpg.create_pool(**self._connect_kwargs, min_size=min(2, self._pool_size), max_size=self._pool_size)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        connection = await self._pool.acquire()
+        self.pool_wait_seconds.append(time.perf_counter() - started)
+        return connection
+
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        connection = await self._acquire()
+        try:
+            if ignore_conflicts or (isinstance(records, list) and len(records) < self.COPY_THRESHOLD):
+                placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+                query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+                if ignore_conflicts:
+                    query += f" ON CONFLICT {self.CONFLICT_KEYS[table]} DO NOTHING"
+                records = list(records)
+                await connection.executemany(query, records)
+                return len(records)
+            result = await connection.copy_records_to_table(table, records=records, columns=columns)
+            # result is the command tag, e.g. 'COPY 5000'
+            return int(result.split()[-1])
+        finally:
+            await self._pool.release(connection)
+
+    async def fetch_topology(self):
+        machines = await self._pool.fetch("SELECT machine_id, machine_name FROM machine")
+        axes = await self._pool.fetch("SELECT axis_id, machine_id, axis_name FROM axis")
+        return machines, axes
+
+
+class Memory_Sink(Sink):
+    # keeps nothing but row counts, for measuring the generator without a database
+    def __init__(self):
+        super().__init__()
+        self.rows = collections.Counter()    # table -> rows written
+        self._machines = {}
+        self._axes = {}
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def _add_topology(self, table, records):
+        # remembers machine / axis rows and returns the ones that were new, axis rows with their
+        # axis id in front. Ids are handed out like a SERIAL column would
+        added = []
+        for record in records:
+            if table == 'machine' and record[0] not in self._machines:
+                self._machines[record[0]] = record[1]
+                added.append(tuple(record))
+            elif table == 'axis' and (record[0], record[1]) not in self._axes:
+                axis_id = self._axes[(record[0], record[1])] = len(self._axes) + 1
+                added.append((axis_id, *record))
+        return added
+
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        if table in ('machine', 'axis'):
+            return len(self._add_topology(table, records))
+        count = sum(1 for _ in records)
+        self.rows[table] += count
+        return count
+
+    async def fetch_topology(self):
+        machines = [{'machine_id': machine_id, 'machine_name': name} for machine_id, name in self._machines.items()]
+        axes = [{'axis_id': axis_id, 'machine_id': machine_id, 'axis_name': axis_name}
+                for (machine_id, axis_name), axis_id in self._axes.items()]
+        return machines, axes
+
+
+class Sqlite_Sink(Sink):
+    # the schema of create_schema.py without partitions, triggers and rollups. sqlite3 blocks,
+    # so statements run in a worker thread, one at a time
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS machine (
+        machine_id INTEGER PRIMARY KEY,
+        machine_name TEXT NOT NULL,
+        tool_capacity INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tool (
+        tool_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        machine_id INTEGER REFERENCES machine(machine_id) ON DELETE CASCADE,
+        tool_offset REAL NOT NULL,
+        feedrate REAL NOT NULL,
+        update_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS tool_usage (
+        usage_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        machine_id INTEGER REFERENCES machine(machine_id) ON DELETE CASCADE,
+        tool_in_use INTEGER NOT NULL,
+        update_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS axis (
+        axis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        machine_id INTEGER REFERENCES machine(machine_id) ON DELETE CASCADE,
+        axis_name TEXT NOT NULL,
+        max_acceleration REAL NOT NULL,
+        max_velocity REAL NOT NULL,
+        UNIQUE (machine_id, axis_name)
+    );
+    CREATE TABLE IF NOT EXISTS axis_data (
+        axis_data_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        axis_id INTEGER REFERENCES axis(axis_id) ON DELETE CASCADE,
+        actual_position REAL NOT NULL,
+        target_position REAL NOT NULL,
+        distance_to_go REAL GENERATED ALWAYS AS (target_position - actual_position) STORED,
+        homed BOOLEAN NOT NULL,
+        acceleration REAL NOT NULL,
+        velocity REAL NOT NULL,
+        update_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_axis_data_axis_id_timestamp ON axis_data (axis_id, update_timestamp);
+    """
+
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self._path = path
+        self._connection = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        # several runner.py shards can share one file, the timeout waits for the other writers
+        self._connection = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._connection.executescript(self.SCHEMA)
+
+    async def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _insert(self, table, columns, records, ignore_conflicts):
+        verb = "INSERT OR IGNORE" if ignore_conflicts else "INSERT"
+        query = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        with self._connection:
+            return self._connection.executemany(query, records).rowcount
+
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        # the lock plays the part of the connection pool
+        started = time.perf_counter()
+        async with self._lock:
+            self.pool_wait_seconds.append(time.perf_counter() - started)
+            return await asyncio.to_thread(self._insert, table, columns, records, ignore_conflicts)
+
+    async def fetch_topology(self):
+        async with self._lock:
+            cursor = self._connection.execute("SELECT machine_id, machine_name FROM machine")
+            machines = [{'machine_id': row[0], 'machine_name': row[1]} for row in cursor]
+            cursor = self._connection.execute("SELECT axis_id, machine_id, axis_name FROM axis")
+            axes = [{'axis_id': row[0], 'machine_id': row[1], 'axis_name': row[2]} for row in cursor]
+        return machines, axes
+
+
+class Arrow_Sink(Memory_Sink):
+    # append-only columnar files for offline analysis, one directory per table under path:
+    #   format 'parquet'  <path>/<table>/<start>-<pid>.parquet, one row group per row_group_size rows
+    #   format 'arrow'    <path>/<table>/<start>-<pid>.arrows, Arrow IPC stream of record batches
+    # the process id in the name keeps the files of runner.py shards apart. Rows are buffered per table
+    # and the files are only complete once the sink is closed. The topology is kept like in Memory_Sink
+    SCHEMAS = {
+        'machine': [('machine_id', 'int64'), ('machine_name', 'string'), ('tool_capacity', 'int32')],
+        'axis': [('axis_id', 'int64'), ('machine_id', 'int64'), ('axis_name', 'string'),
+                 ('max_acceleration', 'float64'), ('max_velocity', 'float64')],
+        'tool': [('machine_id', 'int64'), ('tool_offset', 'float64'), ('feedrate', 'float64'),
+                 ('update_timestamp', 'timestamp')],
+        'tool_usage': [('machine_id', 'int64'), ('tool_in_use', 'int32'), ('update_timestamp', 'timestamp')],
+        'axis_data': [('axis_id', 'int64'), ('actual_position', 'float64'), ('target_position', 'float64'),
+                      ('homed', 'bool'), ('acceleration', 'float64'), ('velocity', 'float64'),
+                      ('update_timestamp', 'timestamp')],
+    }
+
+    def __init__(self, path, format='parquet', row_group_size=100000, compression='zstd'):
+        if pa is None:
+            raise RuntimeError(f"the {format} sink needs pyarrow, pip install pyarrow")
+        if format not in ('parquet', 'arrow'):
+            raise ValueError(f"unknown file format {format}")
+        super().__init__()
+        self._path = path
+        self._format = format
+        self._row_group_size = row_group_size
+        self._compression = compression
+        self._schemas = {
+            table: pa.schema([(name, pa.timestamp('us') if kind == 'timestamp' else pa.type_for_alias(kind))
+                              for name, kind in fields])
+            for table, fields in self.SCHEMAS.items()
+        }
+        self._pending = {}    # table -> [column lists]
+        self._writers = {}    # table -> open parquet / ipc writer
+        self._lock = asyncio.Lock()
+        self._file_prefix = None
+
+    async def connect(self):
+        os.makedirs(self._path, exist_ok=True)
+        self._file_prefix = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}"
+
+    async def close(self):
+        for table in list(self._pending):
+            await self._write_pending(table)
+        async with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        if table in ('machine', 'axis'):
+            records = self._add_topology(table, records)
+            if table == 'axis':
+                columns = ['axis_id', *columns]
+        schema = self._schemas[table]
+        pending = self._pending.setdefault(table, [[] for _ in schema.names])
+        positions = [columns.index(name) if name in columns else None for name in schema.names]
+
+        # columns the database fills in (update_timestamp of tool rows) get the write time
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        count = 0
+        for record in records:
+            for values, position in zip(pending, positions):
+                values.append(now if position is None else record[position])
+            count += 1
+        self.rows[table] += count
+
+        if len(pending[0]) >= self._row_group_size:
+            await self._write_pending(table)
+        return count
+
+    async def _write_pending(self, table):
+        # the buffer is taken before writing so rows arriving meanwhile start the next batch
+        pending = self._pending.pop(table, None)
+        if not pending or not pending[0]:
+            return
+        started = time.perf_counter()
+        async with self._lock:
+            self.pool_wait_seconds.append(time.perf_counter() - started)
+            await asyncio.to_thread(self._write_batch, table, pending)
+
+    def _write_batch(self, table, pending):
+        schema = self._schemas[table]
+        batch = pa.record_batch([pa.array(values, type=field.type) for values, field in zip(pending, schema)], schema=schema)
+        writer = self._writers.get(table)
+        if writer is None:
+            directory = os.path.join(self._path, table)
+            os.makedirs(directory, exist_ok=True)
+            if self._format == 'parquet':
+                writer = pq.ParquetWriter(os.path.join(directory, f"{self._file_prefix}.parquet"), schema,
+                                          compression=self._compression)
+            else:
+                writer = pa.ipc.new_stream(os.path.join(directory, f"{self._file_prefix}.arrows"), schema)
+            self._writers[table] = writer
+        if self._format == 'parquet':
+            writer.write_batch(batch, row_group_size=self._row_group_size)
+        else:
+            writer.write_batch(batch)
+
+
+def make_sink(name, **options):
+    if name == 'postgres':
+        return Postgres_Sink(**options)
+    if name == 'sqlite':
+        return Sqlite_Sink(**options)
+    if name in ('parquet', 'arrow'):
+        return Arrow_Sink(format=name, **options)
+    if name == 'memory':
+        return Memory_Sink()
+    raise ValueError(f"unknown sink {name}")
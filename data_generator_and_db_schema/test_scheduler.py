@@ -0,0 +1,56 @@
+import asyncio
+import time
+import unittest
+
+from scheduler import Tick_Scheduler
+
+
+class Stop(Exception):
+    pass
+
+
+def run_ticks(scheduler, interval, overrun, ticks):
+    # the first tick blocks for overrun intervals, the run ends after ticks ticks
+    calls = []
+
+    async def callback():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            time.sleep(overrun * interval)
+        if len(calls) == ticks:
+            raise Stop
+
+    scheduler.add('test', interval, callback)
+    try:
+        asyncio.run(scheduler.run())
+    except Stop:
+        pass
+    return scheduler.stats[interval], calls
+
+
+class Tick_Scheduler_Test(unittest.TestCase):
+    interval = 0.05
+
+    def test_skip_counts_the_skipped_deadlines(self):
+        stats, calls = run_ticks(Tick_Scheduler(policy='skip', report_interval=None), self.interval, 5.5, 4)
+        # deadlines 1 to 4 passed during the first tick, 5 runs late
+        self.assertEqual(stats.missed, 4)
+        self.assertEqual(stats.ticks, 3)
+
+    def test_catch_up_runs_late_ticks_without_counting_them(self):
+        stats, calls = run_ticks(Tick_Scheduler(policy='catch_up', report_interval=None), self.interval, 5.5, 8)
+        self.assertEqual(stats.missed, 0)
+        # ticks 1 to 5 are run back to back right after the first one
+        self.assertLess(calls[5] - calls[1], self.interval)
+
+    def test_catch_up_counts_the_ticks_beyond_max_catch_up(self):
+        stats, calls = run_ticks(Tick_Scheduler(policy='catch_up', max_catch_up=2, report_interval=None), self.interval, 5.5, 8)
+        self.assertEqual(stats.missed, 2)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Tick_Scheduler(policy='later')
+
+
+if __name__ == '__main__':
+    unittest.main()
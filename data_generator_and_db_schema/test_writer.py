@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import unittest
+
+from generator import Data_generator, Database_Writer, axis, insert_to_axis, machine_data
+from sinks import Memory_Sink
+
+
+class Failing_Sink(Memory_Sink):
+    # fails the next `failures` axis_data writes, then writes like Memory_Sink
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    async def write_rows(self, table, columns, records, ignore_conflicts=False):
+        if table == 'axis_data' and self.failures:
+            self.failures -= 1
+            raise ConnectionError('copy failed')
+        return await super().write_rows(table, columns, records, ignore_conflicts)
+
+
+async def run_ticks(sink, ticks, max_flush_retries=3):
+    # every tick fills a batch, so each flush is triggered by the batch size
+    machine_ids = [1, 2]
+    generator = Data_generator(seed=0)
+    writer = Database_Writer(batch_size=10, max_batch_age=0, sink=sink, max_flush_retries=max_flush_retries)
+    await writer.connect_db()
+    await machine_data(machine_ids, generator, writer)
+    await axis(machine_ids, generator, writer)
+    await writer.load_topology()
+    for _ in range(ticks):
+        await insert_to_axis(machine_ids, generator, writer, vectorized=True)
+    await writer.close()
+    return writer.stats
+
+
+class Database_Writer_Test(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_failed_flushes_are_retried(self):
+        sink = Failing_Sink(failures=2)
+        stats = asyncio.run(run_ticks(sink, ticks=5))
+        self.assertEqual(stats.ticks, 5)
+        # the two failed batches are written with the third flush, every row once
+        self.assertEqual(stats.rows_written, 50)
+        self.assertEqual(sink.rows['axis_data'], 50)
+        self.assertEqual(stats.rows_dropped, 0)
+
+    def test_rows_are_dropped_after_max_flush_retries(self):
+        sink = Failing_Sink(failures=3)
+        stats = asyncio.run(run_ticks(sink, ticks=5, max_flush_retries=2))
+        self.assertEqual(stats.ticks, 5)
+        # the first three ticks are given up on, the last two are written
+        self.assertEqual(stats.rows_dropped, 30)
+        self.assertEqual(stats.rows_written, 20)
+        self.assertEqual(sink.rows['axis_data'], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
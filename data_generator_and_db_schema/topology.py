@@ -0,0 +1,24 @@
+class Topology_Registry:
+    # machine / axis topology kept in memory, the machine and axis tables are written once at
+    # startup so samples can be resolved to an axis_id without a query per insert
+    def __init__(self):
+        self._machines = {}   # machine_id -> machine_name
+        self._axis_ids = {}   # (machine_id, axis_name) -> axis_id
+        self._axes = {}       # axis_id -> (machine_id, axis_name)
+
+    def load_rows(self, machines, axes):
+        self._machines = {row['machine_id']: row['machine_name'] for row in machines}
+        self._axis_ids = {(row['machine_id'], row['axis_name']): row['axis_id'] for row in axes}
+        self._axes = {axis_id: key for key, axis_id in self._axis_ids.items()}
+
+    def axis_id(self, machine_id, axis_name):
+        return self._axis_ids.get((machine_id, axis_name))
+
+    def axis(self, axis_id):
+        return self._axes.get(axis_id)
+
+    def machine_ids(self):
+        return list(self._machines)
+
+    def __len__(self):
+        return len(self._axes)
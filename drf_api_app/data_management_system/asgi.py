@@ -13,6 +13,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.urls import path, re_path
 from user_management.consumers import MachineDataConsumer
+from user_management.tasks import LifespanApp
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'data_management_system.settings')
 
@@ -22,6 +23,8 @@ websocket_urlpatterns = [
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
+    # cancels the WebSocket background tasks when the worker shuts down
+    "lifespan": LifespanApp(),
     "websocket": AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns) 
     ),
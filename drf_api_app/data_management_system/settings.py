@@ -73,7 +73,7 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
+        'user_management.authentication.CachedOAuth2Authentication',
     )
 }
 
@@ -117,7 +117,7 @@ OAUTH2_PROVIDER = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
+        'user_management.authentication.CachedOAuth2Authentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -167,4 +167,52 @@ CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
-}
\ No newline at end of file
+}
+
+# Seconds after which a worker reloads the in-memory machine/axis topology
+# (user_management.topology); writes through the api refresh it immediately
+TOPOLOGY_MAX_AGE = 60
+
+# Sample interval of raw axis data in seconds and the number of rows per axis above which
+# ?resolution=auto on /api/axis-data/ switches to a rollup
+AXIS_DATA_SAMPLE_INTERVAL = 0.01
+AXIS_DATA_MAX_POINTS = 2000
+# Most raw samples (window / sample interval * axes) ?max_points= reads and downsamples in one
+# request, larger windows have to use a rollup resolution
+AXIS_DATA_DOWNSAMPLE_MAX_SAMPLES = 1000000
+
+# Rows fetched per round trip of the server-side cursor of /api/axis-data/export/, also the
+# number of rows per streamed chunk
+AXIS_DATA_EXPORT_CHUNK_SIZE = 5000
+
+# Most time buckets per group /api/axis-data/stats/ computes in one request
+AXIS_DATA_STATS_MAX_BUCKETS = 10000
+
+# Seconds a version counter of the machine / axis resources (user_management.caching) lives in the
+# cache. Writes through the api bump it right away, with a per-process cache (no CACHES configured)
+# other workers see the change after at most this long. Configure a shared cache, e.g.
+#   CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}}
+# to make the versions consistent across workers
+RESOURCE_VERSION_MAX_AGE = 60
+# Responses of the machine / axis endpoints kept per process
+RESPONSE_CACHE_SIZE = 256
+
+# Seconds the group names of a user are cached for the permission classes (user_management.roles).
+# Group changes through the api and the admin invalidate them, with a per-process cache other
+# workers see such changes after at most this long
+ROLES_MAX_AGE = 60
+
+# Validated access tokens kept per process (user_management.authentication) and the seconds one is
+# trusted without looking it up again. Revocations are seen by the worker that revokes right away,
+# by the other workers after at most TOKEN_CACHE_MAX_AGE
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_MAX_AGE = 60
+
+# Most rows of one POST to the bulk endpoints (/data/tools/bulk/, /data/tool-usage/bulk/,
+# /data/axises/bulk/), and the batch size from which they are written with COPY instead of INSERT
+BULK_MAX_ROWS = 10000
+BULK_COPY_THRESHOLD = 1000
+
+# Seconds between two reads of the fleet state by the WebSocket publisher (user_management.publisher),
+# one read per worker process however many clients are connected
+FLEET_PUBLISH_INTERVAL = 1
@@ -38,7 +38,7 @@ from user_management.views import AddUserToGroupView
 from rest_framework.routers import DefaultRouter
 from user_management.views import MachineViewSet, ToolViewSet, ToolUsageViewSet, AxisViewSet, AxisDataViewSet
 
-from user_management.views import AxisDataLast15MinutesView
+from user_management.views import AxisDataLast15MinutesView, AxisDataExportView, AxisDataStatsView, FleetStateView, ServiceStatsView
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -115,4 +115,8 @@ urlpatterns = [
     path('add-user-to-group/', AddUserToGroupView.as_view()),
     path('data/', include(router.urls)),
     path('api/axis-data/', AxisDataLast15MinutesView.as_view(), name='axis_data_last_15_minutes'),
+    path('api/axis-data/stats/', AxisDataStatsView.as_view(), name='axis_data_stats'),
+    path('api/axis-data/export/', AxisDataExportView.as_view(), name='axis_data_export'),
+    path('api/state/', FleetStateView.as_view(), name='fleet_state'),
+    path('api/stats/', ServiceStatsView.as_view(), name='service_stats'),
 ]
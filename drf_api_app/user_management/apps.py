@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 
 class UserManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -8,6 +8,22 @@ class UserManagementConfig(AppConfig):
     def ready(self):
         post_migrate.connect(create_default_groups, sender=self)
 
+        # keep the cached roles of the permission classes in step with group membership
+        from django.contrib.auth.models import Group, User
+        from .roles import group_changed, groups_changed
+        m2m_changed.connect(groups_changed, sender=User.groups.through, dispatch_uid='user_management_roles_m2m')
+        post_save.connect(group_changed, sender=Group, dispatch_uid='user_management_roles_group_save')
+        post_delete.connect(group_changed, sender=Group, dispatch_uid='user_management_roles_group_delete')
+
+        # drop cached access tokens when they are revoked or their user changes
+        from oauth2_provider.models import get_access_token_model
+        from .authentication import access_token_changed, user_changed
+        AccessToken = get_access_token_model()
+        post_save.connect(access_token_changed, sender=AccessToken, dispatch_uid='user_management_token_save')
+        post_delete.connect(access_token_changed, sender=AccessToken, dispatch_uid='user_management_token_delete')
+        post_save.connect(user_changed, sender=User, dispatch_uid='user_management_token_user_save')
+        post_delete.connect(user_changed, sender=User, dispatch_uid='user_management_token_user_delete')
+
 def create_default_groups(sender, **kwargs):  
     from django.contrib.auth.models import Group 
     groups = ['Admin', 'Manager', 'Supervisor', 'Operator']
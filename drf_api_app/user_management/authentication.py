@@ -0,0 +1,147 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import get_access_token_model
+
+from .roles import REQUEST_ATTRIBUTE
+
+# a validated access token: its user, scopes and the unix time the entry stops being trusted
+TokenEntry = namedtuple('TokenEntry', ['user', 'access_token', 'scopes', 'expires_at'])
+
+
+def token_checksum(token):
+    # sha256 of the token, as stored by oauth2_provider in AccessToken.token_checksum
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """
+    In-process LRU of validated access tokens, keyed by the sha256 of the token so the raw
+    tokens are not kept in memory.
+
+    An entry is trusted until the token expires, or for at most max_age seconds. Revoking or
+    changing a token, and changing or deleting its user, invalidates the entries of this process
+    right away (see the signal receivers in apps.py). Other workers see a revocation after at
+    most max_age seconds, which bounds how long a revoked token keeps working there.
+    """
+
+    def __init__(self, size, max_age):
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        """The TokenEntry of a valid cached token, None when it has to be looked up."""
+        key = token_checksum(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # every request gets its own user object, per request state (the roles) must not be shared
+        return entry._replace(user=copy.copy(entry.user))
+
+    def entry(self, user, access_token):
+        expires_at = time.time() + self.max_age
+        if access_token.expires is not None:
+            expires_at = min(expires_at, access_token.expires.timestamp())
+        return TokenEntry(user, access_token, frozenset(access_token.scopes), expires_at)
+
+    def set(self, token, user, access_token):
+        if user is None or getattr(access_token, 'resource', None):
+            # tokens of no user (client credentials) are left to oauthlib, audience restricted
+            # tokens are checked against the uri of every request
+            return
+        user = copy.copy(user)
+        user.__dict__.pop(REQUEST_ATTRIBUTE, None)
+        key = token_checksum(token)
+        with self._lock:
+            self._entries[key] = self.entry(user, access_token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def load(self, token):
+        """Looks up token in the database (for the consumers), returns its TokenEntry or None."""
+        access_token = (
+            get_access_token_model().objects.select_related('user')
+            .filter(token_checksum=token_checksum(token))
+            .first()
+        )
+        if access_token is None or access_token.is_expired() or access_token.user is None:
+            return None
+        if not access_token.user.is_active:
+            return None
+        self.set(token, access_token.user, access_token)
+        return self.entry(access_token.user, access_token)
+
+    def invalidate(self, checksum):
+        with self._lock:
+            self._entries.pop(checksum, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.user.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+token_cache = TokenCache(getattr(settings, 'TOKEN_CACHE_SIZE', 10000), getattr(settings, 'TOKEN_CACHE_MAX_AGE', 60))
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    OAuth2Authentication that validates a bearer token once and then serves it from
+    token_cache, saving the access token and user queries of every further request.
+    """
+
+    def authenticate(self, request):
+        if request is None:
+            return None
+        token = self.bearer_token(request)
+        if token is not None:
+            entry = token_cache.get(token)
+            if entry is not None:
+                return entry.user, entry.access_token
+
+        result = super().authenticate(request)
+        if result is not None and token is not None:
+            token_cache.set(token, *result)
+        return result
+
+    def bearer_token(self, request):
+        # only tokens of the Authorization header are cached, others take the oauthlib path
+        scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            return None
+        return token.strip()
+
+
+def access_token_changed(sender, instance, **kwargs):
+    # post_save / post_delete of AccessToken, revoke() deletes the token
+    token_cache.invalidate(getattr(instance, 'token_checksum', None) or token_checksum(instance.token))
+
+
+def user_changed(sender, instance, **kwargs):
+    # post_save / post_delete of User, e.g. deactivated or password changed
+    token_cache.invalidate_user(instance.pk)
@@ -0,0 +1,216 @@
+import csv
+import io
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .topology import registry
+
+ON_CONFLICT = ['update', 'ignore']
+
+
+def parse_integer(value):
+    if value is None:
+        raise ValueError("this field is required")
+    try:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError
+        return int(value)
+    except ValueError:
+        raise ValueError("must be an integer")
+
+
+def parse_float(value):
+    try:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError
+        return float(value)
+    except ValueError:
+        raise ValueError("must be a number")
+
+
+def parse_boolean(value):
+    if value in (True, 1, 'true'):
+        return True
+    if value in (False, 0, 'false'):
+        return False
+    raise ValueError("must be a boolean")
+
+
+def parse_timestamp(value):
+    # naive values are taken as UTC, like the ?start= / ?end= filters
+    timestamp = parse_datetime(value) if isinstance(value, str) else None
+    if timestamp is None:
+        raise ValueError("must be an ISO 8601 date and time")
+    return timezone.make_aware(timestamp, dt_timezone.utc) if timezone.is_naive(timestamp) else timestamp
+
+
+def decimal_parser(field):
+    quantum = Decimal(1).scaleb(-field.decimal_places)
+    limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+
+    def parse_decimal(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError("must be a number")
+        try:
+            value = Decimal(str(value)).quantize(quantum)
+        except InvalidOperation:
+            raise ValueError("must be a number")
+        if not value.is_finite() or abs(value) >= limit:
+            raise ValueError(f"must have at most {field.max_digits} digits")
+        return value
+    return parse_decimal
+
+
+def field_parser(field):
+    """Function that turns a JSON value into a value of field, raising ValueError with a message."""
+    if isinstance(field, models.DecimalField):
+        return decimal_parser(field)
+    if isinstance(field, models.FloatField):
+        return parse_float
+    if isinstance(field, models.BooleanField):
+        return parse_boolean
+    if isinstance(field, models.DateTimeField):
+        return parse_timestamp
+    return parse_integer
+
+
+def copy_rows(model, columns, records):
+    """Writes records (tuples of the values of columns) with one COPY, triggers fire as for INSERT."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        # the timestamp columns are UTC without time zone
+        writer.writerow([
+            value.astimezone(dt_timezone.utc).replace(tzinfo=None).isoformat() if hasattr(value, 'astimezone') else value
+            for value in record
+        ])
+    sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+        connection.ops.quote_name(model._meta.db_table), ', '.join(connection.ops.quote_name(column) for column in columns))
+    with connection.cursor() as cursor:
+        if hasattr(cursor.cursor, 'copy'):
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+
+
+class BulkCreateMixin:
+    """
+    POST <endpoint>/bulk/ with a list of objects writes all of them in one transaction.
+
+    The rows are checked field by field against the model, and their machine / axis against the
+    topology registry, instead of running a serializer with a foreign key query per row. A batch
+    is written completely or not at all. Small batches go through bulk_create, batches of at least
+    BULK_COPY_THRESHOLD rows through COPY. Rows may carry their primary key and update_timestamp;
+    with ?on_conflict=update (or ignore) a row whose key exists replaces that row (or is skipped),
+    so a gateway can safely resend a batch.
+    """
+    # fields every row has to carry, besides the machine / axis
+    bulk_fields = ()
+    # machine_id for the tool tables, axis_id (or machine_id and axis_name) for axis data
+    bulk_reference = 'machine_id'
+    # columns making a row unique, besides the primary key
+    bulk_unique_fields = ()
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({"detail": "expected a non-empty list of objects"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.BULK_MAX_ROWS:
+            return Response({"detail": f"at most {settings.BULK_MAX_ROWS} rows per request"}, status=status.HTTP_400_BAD_REQUEST)
+        on_conflict = request.query_params.get('on_conflict')
+        if on_conflict is not None and on_conflict not in ON_CONFLICT:
+            return Response({"detail": f"on_conflict must be one of {', '.join(ON_CONFLICT)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        columns, records, errors = self.bulk_records(model, rows, keyed=on_conflict is not None)
+        if errors:
+            return Response({"rows": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            if on_conflict is None and len(records) >= settings.BULK_COPY_THRESHOLD and connection.vendor == 'postgresql':
+                copy_rows(model, columns, records)
+            else:
+                objects = [model(**dict(zip(columns, record))) for record in records]
+                options = {}
+                if on_conflict == 'update':
+                    options = {
+                        'update_conflicts': True,
+                        'unique_fields': [model._meta.pk.name, *self.bulk_unique_fields],
+                        'update_fields': [column for column in columns if column not in (model._meta.pk.attname, *self.bulk_unique_fields)],
+                    }
+                elif on_conflict == 'ignore':
+                    options = {'ignore_conflicts': True}
+                model.objects.bulk_create(objects, batch_size=settings.BULK_COPY_THRESHOLD, **options)
+        return Response({"rows": len(records)}, status=status.HTTP_201_CREATED)
+
+    def bulk_records(self, model, rows, keyed=False):
+        """
+        (columns, records, errors) of rows: the columns written, one tuple per row and
+        {row index: {field: [message]}} of the invalid rows.
+        """
+        pk = model._meta.pk.attname
+        fields = [pk] if keyed else []
+        fields += [*self.bulk_fields, 'update_timestamp']
+        parsers = {name: field_parser(model._meta.get_field(name)) for name in fields}
+        # one time for all rows that do not bring their own
+        now = timezone.now()
+
+        columns = [self.bulk_reference, *fields]
+        records = []
+        errors = {}
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors[index] = {"non_field_errors": ["expected an object"]}
+                continue
+            record = [None] * len(columns)
+            row_errors = {}
+            try:
+                record[0] = self.bulk_reference_value(row)
+            except ValueError as error:
+                row_errors[self.bulk_reference] = [str(error)]
+            for position, name in enumerate(fields, 1):
+                value = row.get(name)
+                if value is None:
+                    if name == 'update_timestamp':
+                        record[position] = now
+                    else:
+                        row_errors[name] = ["this field is required"]
+                    continue
+                try:
+                    record[position] = parsers[name](value)
+                except ValueError as error:
+                    row_errors[name] = [str(error)]
+            if row_errors:
+                errors[index] = row_errors
+            else:
+                records.append(tuple(record))
+        return columns, records, errors
+
+    def bulk_reference_value(self, row):
+        if self.bulk_reference == 'machine_id':
+            machine_id = parse_integer(row.get('machine_id'))
+            if registry.machine(machine_id) is None:
+                raise ValueError(f"unknown machine {machine_id}")
+            return machine_id
+        # axis data: by axis_id, or by machine_id and axis_name
+        if row.get('axis_id') is not None:
+            axis_id = parse_integer(row['axis_id'])
+            if registry.axis(axis_id) is None:
+                raise ValueError(f"unknown axis {axis_id}")
+            return axis_id
+        axis_id = registry.axis_id(parse_integer(row.get('machine_id')), row.get('axis_name'))
+        if axis_id is None:
+            raise ValueError("needs axis_id, or machine_id and axis_name of a known axis")
+        return axis_id
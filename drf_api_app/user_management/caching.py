@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ResourceVersions:
+    """
+    Version counters of rarely changing resources ('machine', 'axis'), kept in a Django cache.
+
+    Viewsets bump the version of a resource when they change it, responses derived from the
+    resource carry its version in their ETag. With a shared cache backend (Redis, Memcached)
+    every worker sees a bump right away; with the default per-process cache a worker notices
+    another worker's change (or a direct write to the database, e.g. by the generator) once
+    its counter expires after max_age seconds, like the topology registry. A counter that has
+    expired starts again from the current time, so versions are never reused.
+    """
+
+    def __init__(self, cache_alias='default', max_age=None):
+        self.cache_alias = cache_alias
+        self.max_age = max_age
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _keys(self, resource):
+        return f'resource-version:{resource}', f'resource-modified:{resource}'
+
+    def get(self, resource):
+        """(version, last modified as a unix timestamp) of a resource."""
+        version_key, modified_key = self._keys(resource)
+        values = self.cache.get_many([version_key, modified_key])
+        if version_key in values and modified_key in values:
+            return values[version_key], values[modified_key]
+        self._start(resource)
+        values = self.cache.get_many([version_key, modified_key])
+        return values.get(version_key, 0), values.get(modified_key, int(time.time()))
+
+    def _start(self, resource):
+        version_key, modified_key = self._keys(resource)
+        now = time.time()
+        self.cache.set_many({version_key: time.time_ns(), modified_key: int(now)}, timeout=self.max_age)
+
+    def bump(self, resource):
+        version_key, modified_key = self._keys(resource)
+        try:
+            self.cache.incr(version_key)
+        except ValueError:
+            # not in the cache (expired or never read), any new value will do
+            self._start(resource)
+            return
+        self.cache.set(modified_key, int(time.time()), timeout=self.max_age)
+
+    def bump_on_commit(self, *resources):
+        transaction.on_commit(lambda: [self.bump(resource) for resource in resources])
+
+
+class ResponseCache:
+    """In-process LRU of response data, keyed by the resource versions the data was read at."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+versions = ResourceVersions(max_age=getattr(settings, 'RESOURCE_VERSION_MAX_AGE', 60))
+response_cache = ResponseCache(getattr(settings, 'RESPONSE_CACHE_SIZE', 256))
+
+
+class VersionedResponseMixin:
+    """
+    Conditional and cached list / retrieve for viewsets of versioned resources.
+
+    The ETag is derived from the versions of version_resources, the accepted format and the
+    request path. A matching If-None-Match (or an If-Modified-Since not older than the last
+    change) is answered with 304 without touching the database, anything else is served from
+    response_cache while the versions stay the same. Authentication and permissions are
+    checked before either, as for any other request.
+    """
+    version_resources = ()
+
+    def versioned_response(self, request, read, *args, **kwargs):
+        current = [versions.get(resource) for resource in self.version_resources]
+        last_modified = max(modified for _, modified in current)
+        key = (tuple(version for version, _ in current), request.accepted_renderer.format, request.get_full_path())
+        etag = '"%s"' % hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+        headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'no-cache'}
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        else:
+            if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+            not_modified = if_modified_since is not None and last_modified <= if_modified_since
+        if not_modified:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        data = response_cache.get(key)
+        if data is None:
+            response = read(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            response_cache.set(key, data)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(request, super().retrieve, *args, **kwargs)
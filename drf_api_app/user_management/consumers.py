@@ -1,32 +1,84 @@
 import json
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from datetime import datetime
-from django.db.models import OuterRef, Subquery
-import asyncio
+
+from .frames import ENCODINGS, decode, encode
+from .publisher import WHOLE_FLEET, Subscription, publisher
+from .tasks import supervisor
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def subscription_values(message):
+    """(machine_ids, axis_names, fields) of a subscribe / unsubscribe message as frozensets, None where left out."""
+    values = []
+    for name, value_type in (('machine_ids', int), ('axis_names', str), ('fields', str)):
+        value = message.get(name)
+        if value is not None:
+            if not isinstance(value, list) or not all(isinstance(item, value_type) and not isinstance(item, bool) for item in value):
+                raise ValueError(f"{name} must be a list of {value_type.__name__}s")
+            value = frozenset(value)
+        values.append(value)
+    return values
+
+
 class MachineDataConsumer(AsyncWebsocketConsumer):
+    """
+    Fleet updates over a WebSocket. The client gets a full snapshot on connect:
+        {"type": "snapshot", "seq": 41, "machine_data": [...], "tool_data": [...], "axis_data": [...]}
+    and then deltas holding only what changed, with the next sequence number:
+        {"type": "delta", "seq": 42, "axis_data": {"updated": [{"axis_id": 7, "velocity": "1.500"}], "removed": []}}
+    A client that sees a gap in the sequence numbers sends {"type": "resync"} for a new snapshot.
+
+    Clients watch the whole fleet until they subscribe to part of it:
+        {"type": "subscribe", "machine_ids": [81258856], "axis_names": ["X", "Y"], "fields": ["velocity"]}
+    adds machines, axis names (of the axis data) and fields to what is watched, the first values of
+    each list narrow it from everything. {"type": "unsubscribe", ...} takes the same lists and removes
+    them. A subscribe without lists watches the whole fleet again, an unsubscribe without lists stops
+    the updates. Both are answered with a snapshot of what is watched now, deltas only hold the
+    watched rows and fields.
+
+    Updates come from the process wide FleetPublisher (publisher.py) through its channel layer
+    group, the consumer itself never polls the database.
+
+    Messages are JSON text frames, or with ?encoding=msgpack (or cbor) on the URL MessagePack (CBOR)
+    binary frames, in both directions. Each message is encoded once per encoding and the same
+    bytes are sent to every client that gets it.
+    """
+
     async def connect(self):
+        self.seq = 0
+        self.subscription = WHOLE_FLEET
+        self.encoding = parse_qs(self.scope.get('query_string', b'').decode()).get('encoding', ['json'])[0]
         await self.accept()
+        if self.encoding not in ENCODINGS:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': f"encoding must be one of {', '.join(ENCODINGS)}"
+            }))
+            await self.close(code=4400)
+            self.encoding = None
+            return
         logger.info("WebSocket connection accepted.")
-        await self.send_initial_data()
-
-        # Start a task to periodically send updates
-        self.update_task = asyncio.create_task(self.periodic_update())
+        # background work of the connection goes through supervisor.spawn(self.channel_name, ...)
+        # and is cancelled on disconnect
+        supervisor.register(self.channel_name)
+        await publisher.subscribe(self.channel_name)
+        await self.send_snapshot()
 
     async def disconnect(self, close_code):
+        if self.encoding is None:
+            return
         logger.info("WebSocket connection closed.")
-        #if hasattr(self, 'update_task'):
-            #self.update_task.cancel()  # Cancel the update task when disconnected
+        supervisor.unregister(self.channel_name)
+        await publisher.unsubscribe(self.channel_name)
 
-    async def receive(self, text_data):
-        logger.info(f"Received data: {text_data}")  # Log the received data
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        logger.info(f"Received data: {text_data or bytes_data}")  # Log the received data
+        text_data_json = decode(text_data if text_data is not None else bytes_data, self.encoding)
         message_type = text_data_json['type']
 
         if message_type == 'authenticate':
@@ -35,13 +87,17 @@ class MachineDataConsumer(AsyncWebsocketConsumer):
             if user:
                 self.user = user
                 logger.info("User authenticated.")
-                await self.send_initial_data()
+                await self.send_message({'type': 'authenticated'})
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Invalid token'
-                }))
+                })
                 logger.warning("Invalid token provided.")
+        elif message_type == 'resync':
+            await self.send_snapshot()
+        elif message_type in ('subscribe', 'unsubscribe'):
+            await self.change_subscription(message_type, text_data_json)
         else:
             await self.handle_data_requests(message_type)
 
@@ -54,93 +110,90 @@ class MachineDataConsumer(AsyncWebsocketConsumer):
             elif message_type == 'get_axis_data':
                 await self.send_axis_data()
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Unknown message type'
-                }))
+                })
                 logger.warning("Unknown message type received.")
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Not authenticated'
-            }))
+            })
             logger.warning("Not authenticated user tried to send data.")
 
-    @database_sync_to_async
-    def get_user_from_token(self, token):
-        from oauth2_provider.models import AccessToken
+    async def get_user_from_token(self, token):
+        # tokens validated before (here or by the REST api) need no database round trip
+        from .authentication import token_cache
+        entry = token_cache.get(token)
+        if entry is None:
+            entry = await database_sync_to_async(token_cache.load)(token)
+        return entry.user if entry is not None else None
+
+    async def change_subscription(self, message_type, message):
         try:
-            return AccessToken.objects.get(token=token).user
-        except Exception:
-            return None
-
-    @database_sync_to_async
-    def get_latest_machine_data(self):
-        from .models import Machine
-        return list(Machine.objects.all().values())
-
-    @database_sync_to_async
-    def get_latest_tool_data(self):
-        from .models import Tool
-        return list(Tool.objects.filter(
-            update_timestamp=Subquery(
-                Tool.objects.filter(machine_id=OuterRef('machine_id'))
-                .order_by('-update_timestamp')
-                .values('update_timestamp')[:1]
-            )
-        ).values())[:-1]
-
-    @database_sync_to_async
-    def get_latest_axis_data(self):
-        from .models import AxisData
-        return list(AxisData.objects.filter(
-            update_timestamp=Subquery(
-                AxisData.objects.filter(axis_id=OuterRef('axis_id'))
-                .order_by('-update_timestamp')
-                .values('update_timestamp')[:1]
-            )
-        ).values())[:-1]
+            values = subscription_values(message)
+        except ValueError as error:
+            await self.send_message({'type': 'error', 'message': str(error)})
+            return
+        if message_type == 'subscribe':
+            if all(value is None for value in values):
+                self.subscription = WHOLE_FLEET
+            else:
+                self.subscription = Subscription(*(
+                    current if value is None else value if current is None else current | value
+                    for current, value in zip(self.subscription, values)
+                ))
+        else:
+            if all(value is None for value in values):
+                self.subscription = Subscription(frozenset(), None, None)
+            else:
+                await publisher.current()
+                self.subscription = Subscription(*(
+                    current if value is None else (everything if current is None else current) - value
+                    for current, value, everything in zip(self.subscription, values, publisher.universe())
+                ))
+        await self.send_snapshot()
+
+    async def send_frame(self, frame):
+        # frames of the json encoding are str, of the binary encodings bytes
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_message(self, message):
+        await self.send_frame(encode(message, self.encoding))
+
+    async def send_data(self, data_type):
+        await self.send_frame(await publisher.table(data_type, self.subscription, self.encoding))
 
     async def send_machine_data(self):
-        machine_data = await self.get_latest_machine_data()
-        await self.send(text_data=json.dumps({
-            'type': 'machine_data',
-            'data': machine_data
-        }))
+        await self.send_data('machine_data')
 
     async def send_tool_data(self):
-        tool_data = await self.get_latest_tool_data()
-        serialized_data = self.serialize_data(tool_data)
-        await self.send(text_data=json.dumps({
-            'type': 'tool_data',
-            'data': serialized_data
-        }))
+        await self.send_data('tool_data')
 
     async def send_axis_data(self):
-        axis_data = await self.get_latest_axis_data()
-        serialized_data = self.serialize_data(axis_data)
-        await self.send(text_data=json.dumps({
-            'type': 'axis_data',
-            'data': serialized_data
-        }))
-
-    async def send_initial_data(self):
-        await self.send_machine_data()
-        await self.send_tool_data()
-        await self.send_axis_data()
-
-    async def periodic_update(self):
-        while True:
-            await self.send_machine_data()
-            await self.send_tool_data()
-            await self.send_axis_data()
-            await asyncio.sleep(1)  # Adjust the frequency of updates as needed
-
-    def serialize_data(self, data):
-        if isinstance(data, list):
-            return [self.serialize_data(item) for item in data]
-        elif isinstance(data, dict):
-            return {key: self.serialize_data(value) for key, value in data.items()}
-        elif isinstance(data, datetime):
-            return data.isoformat()  # Convert datetime to ISO 8601 string
-        return data
+        await self.send_data('axis_data')
+
+    async def send_snapshot(self):
+        self.seq, frame = await publisher.snapshot(self.subscription, self.encoding)
+        await self.send_frame(frame)
+
+    async def fleet_delta(self, event):
+        # group message of the publisher announcing a new sequence number
+        if event['seq'] <= self.seq:
+            # already part of the snapshot the client was sent
+            return
+        if event['seq'] != self.seq + 1:
+            # a delta was lost on the way (e.g. dropped by a full channel), start over
+            await self.send_snapshot()
+            return
+        frame = publisher.delta(event['seq'], self.subscription, self.encoding)
+        if frame is None:
+            # too far behind, the delta is no longer kept
+            await self.send_snapshot()
+            return
+        self.seq = event['seq']
+        await self.send_frame(frame)
@@ -0,0 +1,112 @@
+import itertools
+from operator import itemgetter
+
+import numpy as np
+
+METHODS = ['lttb', 'minmax']
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the n_out points Largest-Triangle-Three-Buckets keeps of the series (x, y).
+
+    The first and last point are always kept. The points in between are split into n_out - 2
+    buckets of (almost) equal size, and of every bucket the point forming the largest triangle
+    with the point kept before it and the mean of the next bucket is kept. This preserves peaks
+    and the visual shape of the series much better than taking every n-th point.
+    """
+    n = len(x)
+    if n_out >= n or n < 3:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+
+    # bucket j covers edges[j]:edges[j + 1], the points between the first and the last one
+    buckets = n_out - 2
+    edges = (np.arange(buckets + 1) * ((n - 2) / buckets)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    counts = np.diff(edges)
+    # mean of every bucket at once, the bucket after the last one is the last point
+    mean_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[n - 1])
+    mean_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[n - 1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for j in range(buckets):
+        lo, hi = edges[j], edges[j + 1]
+        # twice the triangle area for every point of the bucket
+        area = np.abs((x[a] - mean_x[j + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y[j + 1] - y[a]))
+        a = lo + int(area.argmax())
+        selected[j + 1] = a
+    return selected
+
+
+# a sample as read for downsampling: series key, row id, unix time and value
+SAMPLE_DTYPE = np.dtype([('key', np.int64), ('id', np.int64), ('time', np.float64), ('value', np.float64)])
+
+
+# minmax keeps the ends and a minimum and maximum, it needs at least 4 points
+MIN_POINTS = {'lttb': 3, 'minmax': 4}
+
+
+def minmax_indices(x, y, n_out):
+    """
+    Indices of the minimum and maximum of (n_out - 2) // 2 buckets of equal size, plus the first
+    and last point, so at most n_out points. Keeps every extreme, at the cost of a more jagged
+    line than LTTB.
+    """
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = (n_out - 2) // 2
+    if buckets < 1:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    # sorted by bucket, then value: every bucket starts with its minimum and ends with its maximum
+    order = np.lexsort((y, bucket))
+    indices = np.concatenate([order[edges[:-1]], order[edges[1:] - 1], [0, n - 1]])
+    return np.unique(indices)
+
+
+def downsample_series(x, y, max_points, method='lttb'):
+    if method == 'minmax':
+        return minmax_indices(x, y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+def series_indices(keys, x, y, max_points, method='lttb'):
+    """
+    Indices of the points kept when every series of the arrays is downsampled to at most
+    max_points points. The arrays hold several series one after the other, keys (e.g. the
+    axis ids) tells them apart; within a series the points are in time order (x).
+    """
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    kept = []
+    for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(keys)]])):
+        if hi - lo <= max_points:
+            kept.append(np.arange(lo, hi))
+        else:
+            kept.append(lo + downsample_series(x[lo:hi], y[lo:hi], max_points, method))
+    return np.concatenate(kept).astype(np.int64)
+
+
+def downsample_rows(rows, max_points, key_index, time_index, value_index, method='lttb'):
+    """
+    Downsamples rows (tuples) of several series to at most max_points rows per series.
+
+    rows have to be ordered by the series key (row[key_index]) and then by time (row[time_index],
+    a datetime). The shape is taken from row[value_index]. Returns the kept rows in the same order.
+    Rows may also be dicts, with the keys of the values as the indices.
+    """
+    kept = []
+    for _, series in itertools.groupby(rows, key=itemgetter(key_index)):
+        series = list(series)
+        if len(series) <= max_points:
+            kept.extend(series)
+            continue
+        x = np.fromiter((row[time_index].timestamp() for row in series), dtype=np.float64, count=len(series))
+        y = np.fromiter((float(row[value_index]) for row in series), dtype=np.float64, count=len(series))
+        kept.extend(series[index] for index in downsample_series(x, y, max_points, method))
+    return kept
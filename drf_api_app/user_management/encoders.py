@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+
+from .models import AxisData
+from .topology import registry
+
+
+def encode_decimal(value):
+    # DecimalField.to_representation of DRF, the database already returns the model's decimal places
+    return '{:f}'.format(value)
+
+
+def encode_datetime(value):
+    # DateTimeField.to_representation of DRF: current time zone, UTC written as 'Z'
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def field_encoder(model, name):
+    """Function that formats a value of model field `name`, None when the value is used as is."""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if isinstance(field, models.GeneratedField):
+        # formatted like the column it computes, e.g. distance_to_go
+        field = field.output_field
+    if isinstance(field, models.DecimalField):
+        return encode_decimal
+    if isinstance(field, models.DateTimeField):
+        return encode_datetime
+    return None
+
+
+def row_encoder(model, names):
+    """
+    Returns a function turning a row tuple with the values of `names` (as from values_list)
+    into the dict a ModelSerializer with these fields renders. The per field formatting is
+    looked up once here instead of going through Field.to_representation for every value.
+    Names that are not fields of the model (e.g. labels from the topology registry) are
+    passed through.
+    """
+    names = tuple(names)
+    encoders = [(index, encoder) for index, name in enumerate(names)
+                if (encoder := field_encoder(model, name)) is not None]
+
+    def encode(row):
+        row = list(row)
+        for index, encoder in encoders:
+            value = row[index]
+            if value is not None:
+                row[index] = encoder(value)
+        return dict(zip(names, row))
+
+    return encode
+
+
+# raw axis data rows are read with values_list and rendered like AxisDataSerializer, the
+# machine and axis names come from the topology registry
+AXIS_DATA_VALUES = ['actual_position', 'target_position', 'distance_to_go', 'homed', 'acceleration', 'velocity', 'update_timestamp']
+AXIS_DATA_FIELDS = ['machine_id', 'machine_name', 'axis_data_id', 'axis_name', *AXIS_DATA_VALUES]
+encode_axis_data = row_encoder(AxisData, AXIS_DATA_FIELDS)
+
+
+# columns read from axis_data, the names are added from the registry
+AXIS_DATA_ROW = ['axis_id', 'axis_data_id', *AXIS_DATA_VALUES]
+
+
+def encode_axis_data_rows(rows, encode=True):
+    """
+    AXIS_DATA_ROW tuples as dicts in the AxisDataSerializer format. encode=False keeps the
+    values as read (Decimal, datetime) for the columnar renderers.
+    """
+    encode_row = encode_axis_data if encode else (lambda row: dict(zip(AXIS_DATA_FIELDS, row)))
+    labels = {}   # axis_id -> (machine_id, machine_name, axis_name)
+    for axis_id, axis_data_id, *values in rows:
+        label = labels.get(axis_id)
+        if label is None:
+            machine_id, axis_name = registry.axis(axis_id) or (None, None)
+            machine = registry.machine(machine_id) or {}
+            label = labels[axis_id] = (machine_id, machine.get('machine_name'), axis_name)
+        yield encode_row((label[0], label[1], axis_data_id, label[2], *values))
+
+
+def iter_axis_data_rows(queryset, chunk_size=None, encode=True):
+    """
+    Rows of an AxisData queryset as dicts in the AxisDataSerializer format, in one query.
+    With chunk_size the rows are read through a server-side cursor, chunk_size at a time.
+    """
+    rows = queryset.values_list(*AXIS_DATA_ROW)
+    if chunk_size:
+        rows = rows.iterator(chunk_size=chunk_size)
+    return encode_axis_data_rows(rows, encode=encode)
+
+
+def axis_data_rows(queryset, encode=True):
+    return list(iter_axis_data_rows(queryset, encode=encode))
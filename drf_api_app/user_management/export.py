@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from .encoders import AXIS_DATA_FIELDS, iter_axis_data_rows
+
+# output -> content type
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def ndjson_chunks(rows, chunk_rows):
+    # one JSON object per line, chunk_rows lines per chunk
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def csv_chunks(rows, chunk_rows):
+    # header line first, so the first byte does not wait for the query
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(AXIS_DATA_FIELDS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    count = 0
+    for row in rows:
+        writer.writerow(row.values())
+        count += 1
+        if count >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if count:
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    # wbits=31 writes the gzip container. Every chunk is flushed so the client receives data as
+    # it is read instead of when the compressor's window fills up
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_chunks(queryset, output, gzip=False, chunk_size=5000):
+    """
+    Rows of an AxisData queryset as bytes chunks in the given output format. The rows are
+    read through a server-side cursor chunk_size at a time, memory does not grow with the range.
+    """
+    rows = iter_axis_data_rows(queryset, chunk_size=chunk_size)
+    chunks = ndjson_chunks(rows, chunk_size) if output == 'ndjson' else csv_chunks(rows, chunk_size)
+    chunks = (chunk.encode() for chunk in chunks)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+async def async_chunks(chunks):
+    # under ASGI Django buffers synchronous iterators of a StreamingHttpResponse completely.
+    # Every chunk is produced in the thread of the sync views, which holds the database connection
+    # and its server-side cursor
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
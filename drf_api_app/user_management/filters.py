@@ -0,0 +1,58 @@
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .topology import registry
+
+
+def parse_timestamp(request, name):
+    """Optional ISO 8601 query parameter as an aware datetime, naive values are taken as UTC."""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise ValidationError({name: "must be an ISO 8601 date and time"})
+    return make_aware(timestamp) if is_naive(timestamp) else timestamp
+
+
+class TimeRangeFilterBackend(BaseFilterBackend):
+    """?start= and ?end= limit update_timestamp to [start, end)."""
+
+    def filter_queryset(self, request, queryset, view):
+        start = parse_timestamp(request, 'start')
+        end = parse_timestamp(request, 'end')
+        if start is not None:
+            queryset = queryset.filter(update_timestamp__gte=start)
+        if end is not None:
+            queryset = queryset.filter(update_timestamp__lt=end)
+        return queryset
+
+
+class MachineFilterBackend(BaseFilterBackend):
+    """
+    ?machine_id= for the tool tables. For axis data ?machine_id= and ?axis_name= (repeatable)
+    are resolved to axis ids through the topology registry, so the filter stays on the
+    (axis_id, update_timestamp, axis_data_id) index without joining axis.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        machine_id = request.query_params.get('machine_id')
+        axis_names = request.query_params.getlist('axis_name')
+        if machine_id is None and not axis_names:
+            return queryset
+        if machine_id is not None:
+            try:
+                machine_id = int(machine_id)
+            except ValueError:
+                raise ValidationError({'machine_id': "must be an integer"})
+
+        if 'axis' in {field.name for field in queryset.model._meta.get_fields()}:
+            return queryset.filter(axis_id__in=registry.axis_ids(machine_id, axis_names))
+        if axis_names:
+            raise ValidationError({'axis_name': "only applies to axis data"})
+        return queryset.filter(machine_id=machine_id)
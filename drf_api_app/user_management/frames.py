@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# the faster and the binary encodings are only offered when their library is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def binary_default(value):
+    # decimals as numbers, as in the column oriented REST output
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+class FrameJSONEncoder(DjangoJSONEncoder):
+    # datetimes as orjson writes them, so frames do not depend on whether it is installed:
+    # microseconds are kept (DjangoJSONEncoder cuts them to milliseconds), UTC is written as 'Z'
+    def default(self, value):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return super().default(value)
+
+
+def encode_json_stdlib(message):
+    return json.dumps(message, cls=FrameJSONEncoder)
+
+
+if orjson is not None:
+    def encode_json(message):
+        # text frames carry str, orjson writes UTF-8 bytes
+        return orjson.dumps(message, default=json_default, option=orjson.OPT_UTC_Z).decode()
+else:
+    encode_json = encode_json_stdlib
+
+
+def decode_json(data):
+    return json.loads(data)
+
+
+def encode_msgpack(message):
+    return msgpack.packb(message, default=binary_default, use_bin_type=True)
+
+
+def decode_msgpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def binary_values(value):
+    # cbor2 writes decimals and datetimes itself (as decimal fractions and tagged dates), so they
+    # are converted up front to the same numbers and strings as in the msgpack frames
+    if isinstance(value, dict):
+        return {key: binary_values(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [binary_values(item) for item in value]
+    if isinstance(value, (Decimal, datetime)):
+        return binary_default(value)
+    return value
+
+
+def encode_cbor(message):
+    return cbor2.dumps(binary_values(message))
+
+
+def decode_cbor(data):
+    return cbor2.loads(data)
+
+
+# ?encoding= of the WebSocket URL -> (encode, decode); json goes in text frames, the others in binary frames
+ENCODINGS = {'json': (encode_json, decode_json)}
+if msgpack is not None:
+    ENCODINGS['msgpack'] = (encode_msgpack, decode_msgpack)
+if cbor2 is not None:
+    ENCODINGS['cbor'] = (encode_cbor, decode_cbor)
+
+
+def encode(message, encoding='json'):
+    """message as a str (json, sent as a text frame) or bytes (binary frame)."""
+    return ENCODINGS[encoding][0](message)
+
+
+def decode(data, encoding='json'):
+    return ENCODINGS[encoding][1](data)
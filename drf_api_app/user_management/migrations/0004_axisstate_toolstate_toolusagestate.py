@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0003_alter_axis_options_alter_axisdata_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AxisState',
+            fields=[
+                ('axis', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='state', serialize=False, to='user_management.axis')),
+                ('axis_data_id', models.IntegerField()),
+                ('actual_position', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('target_position', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('distance_to_go', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('homed', models.BooleanField()),
+                ('acceleration', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('update_timestamp', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'axis_state',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ToolState',
+            fields=[
+                ('machine', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='tool_state', serialize=False, to='user_management.machine')),
+                ('tool_id', models.IntegerField()),
+                ('tool_offset', models.FloatField()),
+                ('feedrate', models.FloatField()),
+                ('update_timestamp', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'tool_state',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ToolUsageState',
+            fields=[
+                ('machine', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='tool_usage_state', serialize=False, to='user_management.machine')),
+                ('usage_id', models.IntegerField()),
+                ('tool_in_use', models.IntegerField()),
+                ('update_timestamp', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'tool_usage_state',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0004_axisstate_toolstate_toolusagestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AxisDataRollup10s',
+            fields=[
+                ('pk', models.CompositePrimaryKey('axis_id', 'bucket', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('axis_id', models.IntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.IntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('actual_position_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_sum', models.FloatField()),
+                ('actual_position_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_sum', models.FloatField()),
+                ('velocity_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_sum', models.FloatField()),
+                ('acceleration_last', models.DecimalField(decimal_places=3, max_digits=10)),
+            ],
+            options={
+                'db_table': 'axis_data_rollup_10s',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AxisDataRollup1m',
+            fields=[
+                ('pk', models.CompositePrimaryKey('axis_id', 'bucket', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('axis_id', models.IntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.IntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('actual_position_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_sum', models.FloatField()),
+                ('actual_position_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_sum', models.FloatField()),
+                ('velocity_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_sum', models.FloatField()),
+                ('acceleration_last', models.DecimalField(decimal_places=3, max_digits=10)),
+            ],
+            options={
+                'db_table': 'axis_data_rollup_1m',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AxisDataRollup1s',
+            fields=[
+                ('pk', models.CompositePrimaryKey('axis_id', 'bucket', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('axis_id', models.IntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.IntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('actual_position_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('actual_position_sum', models.FloatField()),
+                ('actual_position_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('velocity_sum', models.FloatField()),
+                ('velocity_last', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_min', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_max', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('acceleration_sum', models.FloatField()),
+                ('acceleration_last', models.DecimalField(decimal_places=3, max_digits=10)),
+            ],
+            options={
+                'db_table': 'axis_data_rollup_1s',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 # Machine Model
 class Machine(models.Model):
@@ -20,7 +22,7 @@ class Tool(models.Model):
     machine = models.ForeignKey(Machine, related_name='tool', on_delete=models.CASCADE)
     tool_offset = models.FloatField(null=False)
     feedrate = models.FloatField(null=False)
-    update_timestamp = models.DateTimeField(auto_now_add=True)
+    update_timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'tool'
@@ -35,7 +37,7 @@ class ToolUsage(models.Model):
     usage_id = models.AutoField(primary_key=True)
     machine = models.ForeignKey(Machine, related_name='tool_usage', on_delete=models.CASCADE)
     tool_in_use = models.IntegerField(null=False)
-    update_timestamp = models.DateTimeField(auto_now_add=True)
+    update_timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'tool_usage'
@@ -70,15 +72,17 @@ class AxisData(models.Model):
     axis = models.ForeignKey(Axis, related_name='axis_data', on_delete=models.CASCADE)
     actual_position = models.DecimalField(max_digits=10, decimal_places=3, null=False)
     target_position = models.DecimalField(max_digits=10, decimal_places=3, null=False)
-    distance_to_go = models.DecimalField(max_digits=10, decimal_places=3, null=False, editable=False)
+    # GENERATED ALWAYS column of the table, never written by Django and read back on insert
+    distance_to_go = models.GeneratedField(
+        expression=F('target_position') - F('actual_position'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=3),
+        db_persist=True,
+    )
     homed = models.BooleanField(null=False)
     acceleration = models.DecimalField(max_digits=10, decimal_places=3, null=False)
     velocity = models.DecimalField(max_digits=10, decimal_places=3, null=False)
-    update_timestamp = models.DateTimeField(auto_now_add=True)
-
-    def save(self, *args, **kwargs):
-        self.distance_to_go = self.target_position - self.actual_position
-        super(AxisData, self).save(*args, **kwargs)
+    # a default rather than auto_now_add, which would overwrite the sample times of bulk writes
+    update_timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return f"Axis Data for Axis {self.axis.axis_name} on Machine {self.axis.machine.machine_name}"
@@ -88,6 +92,98 @@ class AxisData(models.Model):
         managed = False
 
 
+# Latest state models, one row per axis or machine.
+# The tables are upserted by triggers on axis_data, tool and tool_usage (see create_schema.py)
+class AxisState(models.Model):
+    axis = models.OneToOneField(Axis, primary_key=True, related_name='state', on_delete=models.DO_NOTHING)
+    axis_data_id = models.IntegerField(null=False)
+    actual_position = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    target_position = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    distance_to_go = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    homed = models.BooleanField(null=False)
+    acceleration = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    velocity = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    update_timestamp = models.DateTimeField(null=False)
+
+    class Meta:
+        db_table = 'axis_state'
+        managed = False
+
+    def __str__(self):
+        return f"State of Axis {self.axis_id}"
+
+
+class ToolState(models.Model):
+    machine = models.OneToOneField(Machine, primary_key=True, related_name='tool_state', on_delete=models.DO_NOTHING)
+    tool_id = models.IntegerField(null=False)
+    tool_offset = models.FloatField(null=False)
+    feedrate = models.FloatField(null=False)
+    update_timestamp = models.DateTimeField(null=False)
+
+    class Meta:
+        db_table = 'tool_state'
+        managed = False
+
+    def __str__(self):
+        return f"Tool State of Machine {self.machine_id}"
+
+
+class ToolUsageState(models.Model):
+    machine = models.OneToOneField(Machine, primary_key=True, related_name='tool_usage_state', on_delete=models.DO_NOTHING)
+    usage_id = models.IntegerField(null=False)
+    tool_in_use = models.IntegerField(null=False)
+    update_timestamp = models.DateTimeField(null=False)
+
+    class Meta:
+        db_table = 'tool_usage_state'
+        managed = False
+
+    def __str__(self):
+        return f"Tool Usage State of Machine {self.machine_id}"
+
+
+# Rollups of axis_data per axis and time bucket, maintained by a trigger on axis_data (see create_schema.py).
+class AxisDataRollup(models.Model):
+    pk = models.CompositePrimaryKey('axis_id', 'bucket')
+    axis_id = models.IntegerField(null=False)
+    bucket = models.DateTimeField(null=False)
+    samples = models.IntegerField(null=False)
+    last_timestamp = models.DateTimeField(null=False)
+    actual_position_min = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    actual_position_max = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    actual_position_sum = models.FloatField(null=False)
+    actual_position_last = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    velocity_min = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    velocity_max = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    velocity_sum = models.FloatField(null=False)
+    velocity_last = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    acceleration_min = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    acceleration_max = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+    acceleration_sum = models.FloatField(null=False)
+    acceleration_last = models.DecimalField(max_digits=10, decimal_places=3, null=False)
+
+    class Meta:
+        abstract = True
+
+
+class AxisDataRollup1s(AxisDataRollup):
+    class Meta:
+        db_table = 'axis_data_rollup_1s'
+        managed = False
+
+
+class AxisDataRollup10s(AxisDataRollup):
+    class Meta:
+        db_table = 'axis_data_rollup_10s'
+        managed = False
+
+
+class AxisDataRollup1m(AxisDataRollup):
+    class Meta:
+        db_table = 'axis_data_rollup_1m'
+        managed = False
+
+
 # Indexes
 class Meta:
     indexes = [
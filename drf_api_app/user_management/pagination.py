@@ -0,0 +1,96 @@
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest first pagination on (update_timestamp, primary key) for the history tables.
+
+    A page continues below the last row of the previous one, carried in an opaque cursor,
+    so every page is an index range scan of page_size rows however deep it is, unlike
+    OFFSET pagination. Rows inserted while paging show up on the first page only.
+    """
+    ordering_field = 'update_timestamp'
+    cursor_query_param = 'cursor'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        pk_name = queryset.model._meta.pk.name
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            # (update_timestamp, pk) < (timestamp, pk), written so the timestamp bound is an index condition
+            queryset = queryset.filter(**{f'{self.ordering_field}__lte': timestamp}).exclude(
+                Q(**{self.ordering_field: timestamp}) & Q(**{f'{pk_name}__gte': pk})
+            )
+
+        # one row more than the page tells whether there is a next page
+        rows = list(queryset.order_by(f'-{self.ordering_field}', f'-{pk_name}')[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.has_next:
+            last = rows[-1]
+            self.next_position = (getattr(last, self.ordering_field), last.pk)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        timestamp, pk = position
+        return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{pk}'.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('first', self.get_first_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
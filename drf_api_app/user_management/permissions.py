@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from .roles import role_cache
+
 class CanReadWebSocketAPI(BasePermission):
     """
     Custom permission to allow 'read' access to WebSocket API for all user groups.
@@ -17,8 +19,7 @@ class CanUpdateWebSocketAPI(BasePermission):
     def has_permission(self, request, view):
         user = request.user
         # Allow update (PUT) for Manager and Supervisor only
-        if request.method == 'PUT' and (user.groups.filter(name='Manager').exists() or 
-                                        user.groups.filter(name='Supervisor').exists()):
+        if request.method == 'PUT' and role_cache.has_role(user, 'Manager', 'Supervisor'):
             return True
         return False
 
@@ -29,6 +30,6 @@ class CanDeleteWebSocketAPI(BasePermission):
     def has_permission(self, request, view):
         user = request.user
         # Allow delete (DELETE) for Supervisor only
-        if request.method == 'DELETE' and user.groups.filter(name='Supervisor').exists():
+        if request.method == 'DELETE' and role_cache.has_role(user, 'Supervisor'):
             return True
         return False
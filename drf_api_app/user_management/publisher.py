@@ -0,0 +1,274 @@
+import asyncio
+import itertools
+import logging
+import os
+from collections import OrderedDict, namedtuple
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .frames import encode
+from .tasks import supervisor
+
+logger = logging.getLogger(__name__)
+
+# tables of a fleet update and the field identifying a row of each
+FLEET_DATA = ['machine_data', 'tool_data', 'axis_data']
+FLEET_KEYS = {'machine_data': 'machine_id', 'tool_data': 'machine_id', 'axis_data': 'axis_id'}
+
+
+def fleet_snapshot():
+    """Machines, latest tool values and latest axis values of the fleet, read from the state tables."""
+    from .models import AxisState, ToolState
+    from .topology import registry
+    axes = list(AxisState.objects.values())
+    # name the axis from the topology registry rather than joining axis
+    for row in axes:
+        row['machine_id'], row['axis_name'] = registry.axis(row['axis_id']) or (None, None)
+    return {
+        'machine_data': registry.machines(),
+        'tool_data': list(ToolState.objects.values()),
+        'axis_data': axes,
+    }
+
+
+# sequence numbers whose deltas are kept for clients that fall behind
+HISTORY = 8
+
+
+class Subscription(namedtuple('Subscription', ['machine_ids', 'axis_names', 'fields'])):
+    """
+    What a client watches: frozensets of machine ids, axis names (of the axis data) and fields,
+    None for all of them. Subscriptions are hashable, clients with equal subscriptions share the
+    encoded messages.
+    """
+
+    def accepts(self, data_type, row):
+        if self.machine_ids is not None and row['machine_id'] not in self.machine_ids:
+            return False
+        return self.axis_names is None or data_type != 'axis_data' or row['axis_name'] in self.axis_names
+
+    def project(self, data_type, row):
+        # the key of a row is always sent
+        if self.fields is None:
+            return row
+        key = FLEET_KEYS[data_type]
+        return {name: value for name, value in row.items() if name == key or name in self.fields}
+
+
+WHOLE_FLEET = Subscription(None, None, None)
+
+
+def index_snapshot(snapshot):
+    """{data type: {row key: row}} of a snapshot."""
+    return {
+        data_type: {row[FLEET_KEYS[data_type]]: row for row in snapshot[data_type]}
+        for data_type in FLEET_DATA
+    }
+
+
+def machine_index(state):
+    """{data type: {machine id: [row keys]}} of an indexed snapshot, to select the rows of a few machines."""
+    index = {}
+    for data_type in FLEET_DATA:
+        rows = index[data_type] = {}
+        for row_key, row in state[data_type].items():
+            rows.setdefault(row['machine_id'], []).append(row_key)
+    return index
+
+
+def table_delta(old, new, key):
+    """
+    (updated, removed) between two indexed tables. updated holds (row, change) pairs: the new
+    row and what is sent for it, the whole row when it is new, else its key and the changed
+    fields. removed holds the rows that are gone.
+    """
+    updated = []
+    for row_key, row in new.items():
+        before = old.get(row_key)
+        if before is None:
+            updated.append((row, row))
+        elif before != row:
+            changed = {name: value for name, value in row.items() if before.get(name) != value}
+            changed[key] = row_key
+            updated.append((row, changed))
+    removed = [row for row_key, row in old.items() if row_key not in new]
+    return updated, removed
+
+
+def fleet_delta(old, new):
+    """Changes of every table between two indexed snapshots, empty when nothing changed."""
+    changes = {}
+    for data_type in FLEET_DATA:
+        updated, removed = table_delta(old.get(data_type, {}), new[data_type], FLEET_KEYS[data_type])
+        if updated or removed:
+            changes[data_type] = (updated, removed)
+    return changes
+
+
+def select_rows(state, index, data_type, subscription):
+    """Rows of one table a subscription watches, only the rows of its machines are looked at."""
+    rows = state[data_type]
+    if subscription.machine_ids is None:
+        candidates = rows.values()
+    else:
+        by_machine = index[data_type]
+        candidates = (rows[row_key] for machine_id in subscription.machine_ids for row_key in by_machine.get(machine_id, ()))
+    return [subscription.project(data_type, row) for row in candidates if subscription.accepts(data_type, row)]
+
+
+def select_changes(changes, subscription):
+    """The part of a delta a subscription watches, as sent to the clients."""
+    selected = {}
+    for data_type, (updated, removed) in changes.items():
+        key = FLEET_KEYS[data_type]
+        selected_updated = [subscription.project(data_type, change) for row, change in updated if subscription.accepts(data_type, row)]
+        selected_removed = [row[key] for row in removed if subscription.accepts(data_type, row)]
+        if subscription.fields is not None:
+            # changes of unwatched fields leave just the key
+            selected_updated = [change for change in selected_updated if len(change) > 1]
+        if selected_updated or selected_removed:
+            selected[data_type] = {'updated': selected_updated, 'removed': selected_removed}
+    return selected
+
+
+class FleetPublisher:
+    """
+    Reads the fleet state once per interval for all WebSocket clients of this process.
+
+    Consumers join the publisher's channel layer group on connect. While the group has members
+    a single task reads a snapshot, compares it with the previous one and, when anything changed,
+    announces the new sequence number to the group. Deltas carry a sequence number that grows
+    by one per delta; clients start from a full snapshot (sent on connect and on resync) and
+    apply the deltas after its sequence number. Quiet ticks send nothing, so the bandwidth
+    follows the rate of change rather than the size of the fleet.
+
+    Clients may watch part of the fleet (a Subscription). Every message is selected from the
+    indexed state once per sequence number and subscription, and encoded once per encoding
+    (frames.py), however many clients share it, so neither the database load nor the filtering
+    and encoding work grow with the number of clients. The group name includes the process id: with a shared channel layer
+    (Redis) every worker still only feeds its own clients.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.group = f'fleet-{os.getpid()}'
+        self.subscribers = 0
+        self.seq = 0
+        self.state = None
+        self.index = None
+        # changes and encoded messages of the last HISTORY sequence numbers
+        self.history = OrderedDict()
+        self._encoded = OrderedDict()
+        self._task = None
+        # reads and their deltas happen one at a time, in sequence order
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel_name):
+        await get_channel_layer().group_add(self.group, channel_name)
+        self.subscribers += 1
+        if self._task is None or self._task.done():
+            self._task = supervisor.spawn('publisher', self.run(), name='fleet-publisher')
+
+    async def unsubscribe(self, channel_name):
+        await get_channel_layer().group_discard(self.group, channel_name)
+        self.subscribers = max(self.subscribers - 1, 0)
+
+    async def read(self):
+        """Reads the fleet state, returns its changes and advances seq when there are any."""
+        state = index_snapshot(await database_sync_to_async(fleet_snapshot)())
+        changes = fleet_delta(self.state or {}, state)
+        self.state = state
+        self.index = machine_index(state)
+        if changes:
+            self.seq += 1
+            self.history[self.seq] = changes
+            while len(self.history) > HISTORY:
+                self.history.popitem(last=False)
+            while len(self._encoded) >= HISTORY:
+                self._encoded.popitem(last=False)
+        return changes
+
+    def encoded(self, seq, name, encoding, build):
+        # built and encoded once per sequence number and encoding, however many clients ask for it
+        encoded = self._encoded.setdefault(seq, {})
+        if (name, encoding) not in encoded:
+            message = encoded.get(name)
+            if message is None:
+                message = encoded[name] = build()
+            encoded[name, encoding] = encode(message, encoding)
+        return encoded[name, encoding]
+
+    async def current(self):
+        # the fleet state is read first when there is none yet
+        async with self._lock:
+            if self.state is None:
+                await self.read()
+
+    async def snapshot(self, subscription=WHOLE_FLEET, encoding='json'):
+        """(seq, encoded snapshot of what subscription watches)."""
+        await self.current()
+        return self.seq, self.encoded(self.seq, ('snapshot', subscription), encoding, lambda: {
+            'type': 'snapshot',
+            'seq': self.seq,
+            **{data_type: select_rows(self.state, self.index, data_type, subscription) for data_type in FLEET_DATA},
+        })
+
+    async def table(self, data_type, subscription=WHOLE_FLEET, encoding='json'):
+        """One table of the current state, as {"type": data_type, "data": rows}."""
+        await self.current()
+        return self.encoded(self.seq, (data_type, subscription), encoding, lambda: {
+            'type': data_type,
+            'data': select_rows(self.state, self.index, data_type, subscription),
+        })
+
+    def delta(self, seq, subscription=WHOLE_FLEET, encoding='json'):
+        """
+        Encoded delta of seq for subscription, None when seq is no longer kept. When none of the
+        changes are watched it only carries the sequence number, so clients see no gap.
+        """
+        if seq not in self.history:
+            return None
+        return self.encoded(seq, ('delta', subscription), encoding, lambda: {
+            'type': 'delta', 'seq': seq, **select_changes(self.history[seq], subscription),
+        })
+
+    async def publish(self):
+        async with self._lock:
+            changes = await self.read()
+            if changes:
+                await get_channel_layer().group_send(self.group, {'type': 'fleet.delta', 'seq': self.seq})
+
+    def universe(self):
+        """Subscription of everything currently in the fleet, to unsubscribe from parts of it."""
+        from .models import Axis
+        fields = set()
+        for data_type in FLEET_DATA:
+            for row in itertools.islice(self.state[data_type].values(), 1):
+                fields.update(row)
+        return Subscription(
+            frozenset(self.index['machine_data']),
+            frozenset(name for name, _ in Axis.AXIS_CHOICES),
+            frozenset(fields),
+        )
+
+    async def run(self):
+        # new clients are sent a snapshot on connect, the first tick follows one interval later.
+        # Stops once the last client is gone, the next subscribe starts a new task
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.subscribers == 0:
+                break
+            try:
+                await self.publish()
+            except Exception:
+                logger.exception("Publishing the fleet state failed.")
+        # the next client starts from a fresh read, seq keeps growing
+        self.state = None
+        self.index = None
+        self.history.clear()
+        self._encoded.clear()
+
+
+publisher = FleetPublisher(interval=getattr(settings, 'FLEET_PUBLISH_INTERVAL', 1))
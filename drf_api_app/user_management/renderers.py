@@ -0,0 +1,142 @@
+from datetime import datetime
+from decimal import Decimal
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+# the binary formats are only offered when their library is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# columns that repeat a few values over many rows, sent as a dictionary of the distinct values
+# and one index per row
+DICTIONARY_FIELDS = ('machine_id', 'machine_name', 'axis_name')
+
+
+def is_table(data):
+    # a list of row dicts as returned by the axis data, rollup and state reads
+    return isinstance(data, list) and all(isinstance(row, dict) for row in data)
+
+
+def row_columns(rows):
+    """Rows (dicts with the same keys) as {name: [values]}, in the key order of the first row."""
+    names = list(rows[0]) if rows else []
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def plain_column(values):
+    # decimals as floats and times as epoch milliseconds, so clients need no per value parsing
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, Decimal):
+        return [None if value is None else float(value) for value in values]
+    if isinstance(sample, datetime):
+        return [None if value is None else value.timestamp() * 1000 for value in values]
+    return values
+
+
+def dictionary_column(values):
+    index = {}
+    indices = [index.setdefault(value, len(index)) for value in values]
+    return {'dictionary': list(index), 'indices': indices}
+
+
+def columnar(data):
+    """
+    Column oriented form of a table (or of a dict of tables):
+        {"length": rows, "columns": {name: [values], machine_id: {"dictionary": [...], "indices": [...]}}}
+    Anything else (e.g. error details) is returned unchanged.
+    """
+    if is_table(data):
+        columns = row_columns(data)
+        return {
+            'length': len(data),
+            'columns': {
+                name: dictionary_column(values) if name in DICTIONARY_FIELDS else plain_column(values)
+                for name, values in columns.items()
+            },
+        }
+    if isinstance(data, dict) and data and all(is_table(value) for value in data.values()):
+        return {name: columnar(value) for name, value in data.items()}
+    return data
+
+
+class ColumnarRenderer(BaseRenderer):
+    # views check this to hand over rows with native values (Decimal, datetime) instead of the
+    # strings the serializers produce for the row JSON
+    columnar = True
+
+
+class ColumnarJSONRenderer(ColumnarRenderer, JSONRenderer):
+    media_type = 'application/vnd.columns+json'
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnar(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(ColumnarRenderer):
+    """The column oriented form of ColumnarJSONRenderer as MessagePack."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(columnar(data), use_bin_type=True)
+
+
+class ArrowRenderer(ColumnarRenderer):
+    """
+    A table as an Apache Arrow IPC stream, with dictionary encoded machine / axis columns and
+    UTC timestamps. Only single tables can be rendered, anything else (e.g. error details)
+    becomes a table of one row.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def arrow_array(self, name, values):
+        sample = next((value for value in values if value is not None), None)
+        if isinstance(sample, Decimal):
+            return pa.array([None if value is None else float(value) for value in values], type=pa.float64())
+        if isinstance(sample, datetime):
+            return pa.array(values, type=pa.timestamp('us', tz='UTC'))
+        array = pa.array(values)
+        return array.dictionary_encode() if name in DICTIONARY_FIELDS else array
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not is_table(data):
+            data = [dict(data)] if isinstance(data, dict) else [{'data': data}]
+        columns = row_columns(data)
+        table = pa.table({name: self.arrow_array(name, values) for name, values in columns.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+COLUMNAR_RENDERERS = [ColumnarJSONRenderer]
+if msgpack is not None:
+    COLUMNAR_RENDERERS.append(MessagePackRenderer)
+if pa is not None:
+    COLUMNAR_RENDERERS.append(ArrowRenderer)
+
+# renderers of the axis data, rollup and state reads, chosen by the Accept header or ?format=
+TABLE_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, *COLUMNAR_RENDERERS]
+
+
+def wants_columns(request):
+    return getattr(request.accepted_renderer, 'columnar', False)
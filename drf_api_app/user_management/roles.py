@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# attribute of the user object of a request holding its roles, request.user lives for one request
+REQUEST_ATTRIBUTE = '_user_management_roles'
+
+
+class RoleCache:
+    """
+    Group names ("roles") of users for the permission classes.
+
+    A user's groups are loaded with one query and kept in a Django cache for max_age seconds,
+    and on the user object for the rest of the request, so stacked permission checks cost no
+    queries. Adding users to groups through AddUserToGroupSerializer and group changes in the
+    admin invalidate the cache (see the signal receivers in apps.py). With the default
+    per-process cache other workers see such changes after at most max_age seconds, a shared
+    cache backend makes them visible right away.
+    """
+
+    def __init__(self, cache_alias='default', max_age=None):
+        self.cache_alias = cache_alias
+        self.max_age = max_age
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _generation(self):
+        # changes to a group affect all of its members, they bump the generation instead of
+        # looking up every member
+        generation = self.cache.get('roles-generation')
+        if generation is None:
+            self.cache.add('roles-generation', 0, timeout=None)
+            generation = self.cache.get('roles-generation', 0)
+        return generation
+
+    def _key(self, user_id):
+        return f'roles:{self._generation()}:{user_id}'
+
+    def roles(self, user):
+        """frozenset of the group names of user, empty for anonymous users."""
+        if user is None or not user.is_authenticated:
+            return frozenset()
+        roles = getattr(user, REQUEST_ATTRIBUTE, None)
+        if roles is not None:
+            return roles
+
+        key = self._key(user.pk)
+        roles = self.cache.get(key)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            self.cache.set(key, roles, timeout=self.max_age)
+        setattr(user, REQUEST_ATTRIBUTE, roles)
+        return roles
+
+    def has_role(self, user, *names):
+        """True when user is in any of the groups names."""
+        return not self.roles(user).isdisjoint(names)
+
+    def invalidate(self, user_id):
+        self.cache.delete(self._key(user_id))
+
+    def invalidate_all(self):
+        try:
+            self.cache.incr('roles-generation')
+        except ValueError:
+            self.cache.set('roles-generation', 1, timeout=None)
+
+
+role_cache = RoleCache(max_age=getattr(settings, 'ROLES_MAX_AGE', 60))
+
+
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # m2m_changed of User.groups, from either side
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        role_cache.invalidate(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            role_cache.invalidate(user_id)
+    else:
+        # group.user_set.clear() does not say which users were members
+        role_cache.invalidate_all()
+
+
+def group_changed(sender, **kwargs):
+    # post_save / post_delete of Group, a renamed or deleted group changes the roles of its members
+    role_cache.invalidate_all()
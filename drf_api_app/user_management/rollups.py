@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from .models import AxisDataRollup1s, AxisDataRollup10s, AxisDataRollup1m
+from .topology import registry
+
+# resolution -> (model, bucket width), finest first
+ROLLUPS = {
+    '1s': (AxisDataRollup1s, timedelta(seconds=1)),
+    '10s': (AxisDataRollup10s, timedelta(seconds=10)),
+    '1m': (AxisDataRollup1m, timedelta(minutes=1)),
+}
+RESOLUTIONS = ['raw', *ROLLUPS, 'auto']
+ROLLUP_FIELDS = ['actual_position', 'velocity', 'acceleration']
+
+
+def choose_resolution(window):
+    """
+    Finest resolution that returns at most AXIS_DATA_MAX_POINTS rows per axis for a time window,
+    the coarsest rollup when none does.
+    """
+    seconds = window.total_seconds()
+    if seconds / settings.AXIS_DATA_SAMPLE_INTERVAL <= settings.AXIS_DATA_MAX_POINTS:
+        return 'raw'
+    for resolution, (_, width) in ROLLUPS.items():
+        if seconds / width.total_seconds() <= settings.AXIS_DATA_MAX_POINTS:
+            return resolution
+    return list(ROLLUPS)[-1]
+
+
+def rollup_rows(resolution, axis_ids, start, end=None):
+    """Buckets of the given axes overlapping [start, end), as dicts for AxisDataRollupSerializer."""
+    model, width = ROLLUPS[resolution]
+    queryset = model.objects.filter(axis_id__in=axis_ids, bucket__gt=start - width)
+    if end is not None:
+        queryset = queryset.filter(bucket__lt=end)
+
+    rows = []
+    for row in queryset.order_by('axis_id', 'bucket').values():
+        machine_id, axis_name = registry.axis(row['axis_id']) or (None, None)
+        machine = registry.machine(machine_id) or {}
+        row.update(machine_id=machine_id, machine_name=machine.get('machine_name'), axis_name=axis_name)
+        for field in ROLLUP_FIELDS:
+            row[f'{field}_avg'] = row.pop(f'{field}_sum') / row['samples']
+        rows.append(row)
+    return rows
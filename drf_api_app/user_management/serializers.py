@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers
-from .models import Machine, Tool, ToolUsage, Axis, AxisData
+from .models import Machine, Tool, ToolUsage, Axis, AxisData, AxisState, ToolState, ToolUsageState
+from .topology import registry
+from .roles import role_cache
 
 
 class AddUserToGroupSerializer(serializers.Serializer):
@@ -28,6 +30,8 @@ class AddUserToGroupSerializer(serializers.Serializer):
         group = Group.objects.get(name=self.validated_data['group'])
 
         user.groups.add(group)
+        # the m2m_changed receiver does the same, the permission checks must not see the old groups
+        role_cache.invalidate(user.pk)
         return user
 
         
@@ -62,7 +66,56 @@ class AxisDataSerializer(serializers.ModelSerializer):
     axis_name = serializers.CharField(source='axis.axis_name', read_only=True)
     machine_id = serializers.IntegerField(source='axis.machine.machine_id', read_only=True)
     machine_name = serializers.CharField(source='axis.machine.machine_name', read_only=True)
+    # generated column, rendered as a string like the other decimals
+    distance_to_go = serializers.DecimalField(max_digits=10, decimal_places=3, read_only=True)
     class Meta:
         model = AxisData
         fields = ['machine_id', 'machine_name','axis_data_id', 'axis_name', 'actual_position', 'target_position', 'distance_to_go', 'homed', 'acceleration', 'velocity', 'update_timestamp']
 
+
+class AxisStateSerializer(serializers.ModelSerializer):
+    # names come from the topology registry, reading the state never joins axis or machine
+    machine_id = serializers.SerializerMethodField()
+    axis_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AxisState
+        fields = ['machine_id', 'axis_name', 'axis', 'axis_data_id', 'actual_position', 'target_position', 'distance_to_go', 'homed', 'acceleration', 'velocity', 'update_timestamp']
+
+    def get_machine_id(self, obj):
+        return (registry.axis(obj.axis_id) or (None, None))[0]
+
+    def get_axis_name(self, obj):
+        return (registry.axis(obj.axis_id) or (None, None))[1]
+
+class ToolStateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ToolState
+        fields = '__all__'
+
+class ToolUsageStateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ToolUsageState
+        fields = '__all__'
+
+
+class AxisDataRollupSerializer(serializers.Serializer):
+    # rows of user_management.rollups.rollup_rows
+    machine_id = serializers.IntegerField()
+    machine_name = serializers.CharField()
+    axis_name = serializers.CharField()
+    bucket = serializers.DateTimeField()
+    samples = serializers.IntegerField()
+    last_timestamp = serializers.DateTimeField()
+    actual_position_min = serializers.DecimalField(max_digits=10, decimal_places=3)
+    actual_position_max = serializers.DecimalField(max_digits=10, decimal_places=3)
+    actual_position_avg = serializers.FloatField()
+    actual_position_last = serializers.DecimalField(max_digits=10, decimal_places=3)
+    velocity_min = serializers.DecimalField(max_digits=10, decimal_places=3)
+    velocity_max = serializers.DecimalField(max_digits=10, decimal_places=3)
+    velocity_avg = serializers.FloatField()
+    velocity_last = serializers.DecimalField(max_digits=10, decimal_places=3)
+    acceleration_min = serializers.DecimalField(max_digits=10, decimal_places=3)
+    acceleration_max = serializers.DecimalField(max_digits=10, decimal_places=3)
+    acceleration_avg = serializers.FloatField()
+    acceleration_last = serializers.DecimalField(max_digits=10, decimal_places=3)
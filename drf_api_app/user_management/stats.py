@@ -0,0 +1,123 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Aggregate, Avg, Count, DateTimeField, F, FloatField, Func, IntegerField, Max, Min, Q, StdDev, Value
+from django.db.models.functions import Cast
+
+from .topology import registry
+
+# fields summarised by the stats endpoint
+STATS_FIELDS = ['velocity', 'acceleration', 'distance_to_go']
+# ?group= -> columns the rows are grouped by, None for a field of AxisData itself
+GROUPS = {
+    'axis': {'axis_id': None},
+    'machine': {'machine_id': F('axis__machine_id')},
+    'fleet': {},
+}
+DEFAULT_PERCENTILES = [0.5, 0.95]
+
+# buckets start at multiples of their width counted from here, like the rollup tables
+BUCKET_ORIGIN = datetime(2000, 1, 1, tzinfo=timezone.utc)
+BUCKET_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+class DateBin(Func):
+    """date_bin(width, expression, origin) of PostgreSQL 14+."""
+    function = 'date_bin'
+    output_field = DateTimeField()
+
+    def __init__(self, width, expression, origin=BUCKET_ORIGIN, **extra):
+        super().__init__(Value(width), expression, Value(origin), **extra)
+
+
+class Percentiles(Aggregate):
+    """
+    percentile_cont of several fractions at once, as a list. One sort per group serves all
+    fractions, where a percentile_cont per fraction would sort the group every time.
+    """
+    function = 'percentile_cont'
+    name = 'Percentiles'
+    template = '%(function)s(%(fractions)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fractions, **extra):
+        # the fractions are validated floats, written into the query as an array literal
+        fractions = 'ARRAY[%s]::float8[]' % ', '.join(repr(float(fraction)) for fraction in fractions)
+        super().__init__(expression, fractions=fractions, output_field=ArrayField(FloatField()), **extra)
+
+
+def parse_bucket(value):
+    """'30s', '5m', '1h', '1d' as a timedelta, None for an invalid width."""
+    match = re.fullmatch(r'(\d+)([smhd])', value or '')
+    if match is None or int(match.group(1)) == 0:
+        return None
+    return timedelta(**{BUCKET_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def parse_percentiles(value):
+    """'50,95,99' as [0.5, 0.95, 0.99], None when a value is not between 0 and 100."""
+    try:
+        percentiles = [float(part) / 100 for part in value.split(',') if part]
+    except ValueError:
+        return None
+    if not percentiles or not all(0 <= percentile <= 1 for percentile in percentiles):
+        return None
+    return percentiles
+
+
+def percentile_name(fraction):
+    # 0.5 -> 'p50', 0.995 -> 'p99.5'
+    return 'p' + format(fraction * 100, 'g')
+
+
+def axis_stats(queryset, width=None, group='axis', percentiles=DEFAULT_PERCENTILES):
+    """
+    Statistics of STATS_FIELDS per group and time bucket of width (one bucket when None), computed
+    by PostgreSQL in a single GROUP BY query. Returns one dict per group and bucket.
+    """
+    keys = dict(GROUPS[group])
+    if width is not None:
+        keys['bucket'] = DateBin(width, 'update_timestamp')
+
+    aggregates = {
+        'samples': Count('*'),
+        'first_timestamp': Min('update_timestamp'),
+        'last_timestamp': Max('update_timestamp'),
+        'homed_samples': Count('pk', filter=Q(homed=True)),
+        'homed_ratio': Avg(Cast('homed', IntegerField()), output_field=FloatField()),
+    }
+    for field in STATS_FIELDS:
+        aggregates[f'{field}_min'] = Min(field)
+        aggregates[f'{field}_max'] = Max(field)
+        aggregates[f'{field}_avg'] = Avg(field, output_field=FloatField())
+        aggregates[f'{field}_stddev'] = StdDev(field, output_field=FloatField())
+        if percentiles:
+            aggregates[f'{field}_percentiles'] = Percentiles(field, percentiles)
+
+    if keys:
+        fields = [name for name, expression in keys.items() if expression is None]
+        expressions = {name: expression for name, expression in keys.items() if expression is not None}
+        rows = list(queryset.values(*fields, **expressions).annotate(**aggregates).order_by(*keys))
+    else:
+        rows = [queryset.aggregate(**aggregates)]
+        if not rows[0]['samples']:
+            rows = []
+
+    for row in rows:
+        # time homed estimated from the sample interval, summed over the axes of a machine / the fleet
+        row['homed_seconds'] = row['homed_samples'] * settings.AXIS_DATA_SAMPLE_INTERVAL
+        for field in STATS_FIELDS:
+            values = row.pop(f'{field}_percentiles', None) or [None] * len(percentiles)
+            for fraction, value in zip(percentiles, values):
+                row[f'{field}_{percentile_name(fraction)}'] = value
+        add_labels(row)
+    return rows
+
+
+def add_labels(row):
+    # machine and axis names from the topology registry instead of joining axis and machine
+    if 'axis_id' in row:
+        row['machine_id'], row['axis_name'] = registry.axis(row['axis_id']) or (None, None)
+    if 'machine_id' in row:
+        row['machine_name'] = (registry.machine(row['machine_id']) or {}).get('machine_name')
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSupervisor:
+    """
+    Background tasks of the WebSocket side of a worker process, grouped by owner.
+
+    Consumers register on connect and unregister on disconnect, which cancels every task they
+    spawned, so closed connections leave nothing running. A task that fails is logged and
+    dropped without touching other tasks or its owner. shutdown() cancels everything when the
+    worker exits (see LifespanApp). stats() has the live numbers of connections and tasks, which
+    should go back down as clients leave; counts that only grow point at a leak.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.connections = 0
+        self.started = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def register(self, owner):
+        self._tasks.setdefault(owner, set())
+        self.connections += 1
+
+    def unregister(self, owner):
+        self.connections = max(self.connections - 1, 0)
+        self.cancel(owner)
+        self._tasks.pop(owner, None)
+
+    def spawn(self, owner, coroutine, name=None):
+        """Runs coroutine as a task of owner."""
+        task = asyncio.create_task(coroutine, name=name)
+        self._tasks.setdefault(owner, set()).add(task)
+        self.started += 1
+        task.add_done_callback(lambda task: self._done(owner, task))
+        return task
+
+    def _done(self, owner, task):
+        tasks = self._tasks.get(owner)
+        if tasks is not None:
+            tasks.discard(task)
+        if task.cancelled():
+            self.cancelled += 1
+        elif task.exception() is not None:
+            self.failed += 1
+            logger.error("Task %s of %r failed.", task.get_name(), owner, exc_info=task.exception())
+
+    def tasks(self, owner=None):
+        if owner is not None:
+            return set(self._tasks.get(owner, ()))
+        return {task for tasks in self._tasks.values() for task in tasks}
+
+    def cancel(self, owner):
+        for task in self._tasks.get(owner, ()):
+            task.cancel()
+
+    async def shutdown(self, timeout=5):
+        """Cancels all tasks and waits up to timeout seconds for them to finish."""
+        tasks = self.tasks()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logger.warning("%d tasks did not stop within %s seconds.", len(pending), timeout)
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'tasks': len(self.tasks()),
+            'started': self.started,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+        }
+
+
+supervisor = TaskSupervisor()
+
+
+class LifespanApp:
+    """ASGI lifespan protocol: stops the supervised tasks when the server shuts the worker down."""
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await supervisor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
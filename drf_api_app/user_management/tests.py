@@ -1,8 +1,42 @@
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIRequestFactory
+from django.test import SimpleTestCase, override_settings
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import gzip
+import json
 from django.contrib.auth.models import User, Group
 from .models import Machine, Tool, ToolUsage, Axis, AxisData
+from .rollups import choose_resolution
+from .serializers import AxisDataSerializer
+from .encoders import encode_axis_data
+from .pagination import KeysetPagination
+from .export import csv_chunks, gzip_chunks, ndjson_chunks
+from .renderers import ArrowRenderer, ColumnarJSONRenderer, columnar, msgpack, pa
+import unittest
+import numpy as np
+from .downsampling import downsample_rows, lttb_indices, minmax_indices, series_indices
+from .caching import VersionedResponseMixin, versions
+from rest_framework import viewsets
+from rest_framework.response import Response
+from rest_framework.test import force_authenticate
+from .roles import groups_changed, role_cache
+from .authentication import CachedOAuth2Authentication, TokenCache, access_token_changed, token_cache
+from oauth2_provider.models import AccessToken
+from unittest import mock
+from .bulk import BulkCreateMixin
+from .views import AxisDataLast15MinutesView
+from asgiref.testing import ApplicationCommunicator
+from .consumers import MachineDataConsumer
+from .publisher import FleetPublisher
+from .frames import cbor2, decode, encode, encode_json_stdlib, orjson
+from .tasks import LifespanApp, TaskSupervisor, supervisor
+import asyncio
+from .topology import registry
+from .stats import DateBin, Percentiles, parse_bucket, parse_percentiles, percentile_name
 
 
 class APITestCase(APITestCase):
@@ -54,3 +88,514 @@ class APITestCase(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
         response = self.client.get(reverse('machine-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(AXIS_DATA_SAMPLE_INTERVAL=0.01, AXIS_DATA_MAX_POINTS=2000)
+class ChooseResolutionTestCase(SimpleTestCase):
+
+    def test_short_window_uses_raw_rows(self):
+        self.assertEqual(choose_resolution(timedelta(seconds=10)), 'raw')
+
+    def test_rollup_grows_with_window(self):
+        self.assertEqual(choose_resolution(timedelta(minutes=15)), '1s')
+        self.assertEqual(choose_resolution(timedelta(hours=2)), '10s')
+        self.assertEqual(choose_resolution(timedelta(hours=6)), '1m')
+
+    def test_long_window_uses_coarsest_rollup(self):
+        self.assertEqual(choose_resolution(timedelta(days=30)), '1m')
+
+
+class AxisDataEncoderTestCase(SimpleTestCase):
+
+    def test_matches_serializer(self):
+        machine = Machine(machine_id=81258856, machine_name="81258856", tool_capacity=24)
+        axis = Axis(axis_id=7, machine=machine, axis_name="X", max_acceleration=200, max_velocity=60)
+        axis_data = AxisData(axis_data_id=1, axis=axis, actual_position=Decimal('-12.500'),
+                             target_position=Decimal('100.000'), distance_to_go=Decimal('112.500'), homed=True,
+                             acceleration=Decimal('10.125'), velocity=Decimal('20.000'),
+                             update_timestamp=datetime(2024, 1, 2, 3, 4, 5, 600000, tzinfo=timezone.utc))
+        row = (81258856, "81258856", 1, "X", axis_data.actual_position, axis_data.target_position, axis_data.distance_to_go,
+               True, axis_data.acceleration, axis_data.velocity, axis_data.update_timestamp)
+        self.assertEqual(encode_axis_data(row), AxisDataSerializer(axis_data).data)
+
+    def test_distance_to_go_is_a_decimal_string(self):
+        axis_data = AxisData(axis_data_id=1, actual_position=Decimal('1.000'), target_position=Decimal('3.500'),
+                             distance_to_go=Decimal('2.5'), homed=True, acceleration=Decimal('0.000'), velocity=Decimal('0.000'))
+        self.assertEqual(AxisDataSerializer(axis_data).data['distance_to_go'], "2.500")
+
+
+class KeysetPaginationTestCase(SimpleTestCase):
+
+    def request(self, **params):
+        return Request(APIRequestFactory().get('/data/tools/', params))
+
+    def test_cursor_round_trip(self):
+        pagination = KeysetPagination()
+        position = (datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc), 42)
+        cursor = pagination.encode_cursor(position)
+        self.assertEqual(pagination.decode_cursor(self.request(cursor=cursor)), position)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            KeysetPagination().decode_cursor(self.request(cursor='not a cursor'))
+
+    def test_page_size_is_bounded(self):
+        pagination = KeysetPagination()
+        self.assertEqual(pagination.get_page_size(self.request()), 100)
+        self.assertEqual(pagination.get_page_size(self.request(page_size=10)), 10)
+        self.assertEqual(pagination.get_page_size(self.request(page_size=100000)), 1000)
+
+
+class ExportChunksTestCase(SimpleTestCase):
+    rows = [{'axis_data_id': 1, 'homed': True}, {'axis_data_id': 2, 'homed': False}, {'axis_data_id': 3, 'homed': True}]
+
+    def test_ndjson_chunks(self):
+        chunks = list(ndjson_chunks(iter(self.rows), 2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([json.loads(line) for line in ''.join(chunks).splitlines()], self.rows)
+
+    def test_csv_starts_with_header(self):
+        chunks = list(csv_chunks(iter(self.rows), 2))
+        self.assertTrue(chunks[0].startswith('machine_id,machine_name,axis_data_id'))
+        self.assertEqual(''.join(chunks[1:]).splitlines(), ['1,True', '2,False', '3,True'])
+
+    def test_gzip_chunks(self):
+        chunks = [chunk.encode() for chunk in ndjson_chunks(iter(self.rows), 1)]
+        compressed = list(gzip_chunks(iter(chunks)))
+        # every input chunk produces output right away
+        self.assertTrue(all(compressed[:len(chunks)]))
+        self.assertEqual(gzip.decompress(b''.join(compressed)), b''.join(chunks))
+
+
+class ColumnarRendererTestCase(SimpleTestCase):
+    rows = [
+        {'machine_id': 1, 'axis_name': axis_name, 'velocity': Decimal('2.500'),
+         'update_timestamp': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+        for axis_name in 'XYX'
+    ]
+
+    def test_columns(self):
+        data = columnar(self.rows)
+        self.assertEqual(data['length'], 3)
+        self.assertEqual(data['columns']['axis_name'], {'dictionary': ['X', 'Y'], 'indices': [0, 1, 0]})
+        self.assertEqual(data['columns']['velocity'], [2.5, 2.5, 2.5])
+        self.assertEqual(data['columns']['update_timestamp'], [1704067200000.0] * 3)
+
+    def test_details_are_not_columns(self):
+        self.assertEqual(json.loads(ColumnarJSONRenderer().render({'detail': 'No data'})), {'detail': 'No data'})
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_arrow_stream(self):
+        table = pa.ipc.open_stream(ArrowRenderer().render(self.rows)).read_all()
+        self.assertEqual(table.num_rows, 3)
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('axis_name').type))
+        self.assertEqual(table.column('velocity').to_pylist(), [2.5, 2.5, 2.5])
+
+
+class DownsamplingTestCase(SimpleTestCase):
+    x = np.arange(10000, dtype=np.float64)
+    y = np.sin(x / 500) + np.where(x == 4321, 10.0, 0.0)
+
+    def test_lttb_keeps_ends_and_peak(self):
+        indices = lttb_indices(self.x, self.y, 500)
+        self.assertEqual(len(indices), 500)
+        self.assertEqual((indices[0], indices[-1]), (0, 9999))
+        self.assertTrue((np.diff(indices) > 0).all())
+        self.assertIn(4321, indices)
+
+    def test_minmax_keeps_extremes(self):
+        indices = minmax_indices(self.x, self.y, 500)
+        self.assertLessEqual(len(indices), 500)
+        self.assertIn(4321, indices)
+        self.assertIn(int(self.y.argmin()), indices)
+
+    def test_short_series_are_kept(self):
+        self.assertEqual(list(lttb_indices(self.x[:5], self.y[:5], 10)), [0, 1, 2, 3, 4])
+
+    def test_minmax_never_exceeds_n_out(self):
+        for n_out in range(2, 12):
+            self.assertLessEqual(len(minmax_indices(self.x, self.y, n_out)), n_out)
+
+    def test_minmax_needs_four_points(self):
+        view = AxisDataLast15MinutesView()
+        view.request = Request(APIRequestFactory().get('/api/axis-data', {'max_points': 3, 'downsample': 'minmax'}))
+        with self.assertRaises(ValidationError):
+            view.get_downsampling(view.downsample_fields)
+        view.request = Request(APIRequestFactory().get('/api/axis-data', {'max_points': 4, 'downsample': 'minmax'}))
+        self.assertEqual(view.get_downsampling(view.downsample_fields), (4, 'minmax', 'actual_position'))
+
+    def test_raw_window_is_bounded(self):
+        view = AxisDataLast15MinutesView()
+        view.request = Request(APIRequestFactory().get('/api/axis-data', {'machine_id': 1, 'max_points': 500}))
+        end = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        with mock.patch.object(view, 'get_axis_ids', return_value=[1, 2, 3, 4, 5]):
+            view.check_raw_window(end - timedelta(minutes=15), end)
+            with self.assertRaises(ValidationError) as raised:
+                view.check_raw_window(end - timedelta(hours=6), end)
+        self.assertIn('resolution', str(raised.exception.detail['max_points']))
+
+    def test_series_indices(self):
+        keys = np.repeat([1, 2], [10000, 50])
+        x = np.concatenate([self.x, np.arange(50, dtype=np.float64)])
+        y = np.concatenate([self.y, np.zeros(50)])
+        indices = series_indices(keys, x, y, 100)
+        self.assertEqual([int((keys[indices] == key).sum()) for key in (1, 2)], [100, 50])
+        self.assertIn(4321, indices)
+
+    def test_rows_per_series(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        rows = [(axis_id, start + timedelta(seconds=i), float(i % 7)) for axis_id in (1, 2) for i in range(1000)]
+        kept = downsample_rows(rows, 100, key_index=0, time_index=1, value_index=2)
+        self.assertEqual([sum(1 for row in kept if row[0] == axis_id) for axis_id in (1, 2)], [100, 100])
+        self.assertEqual(kept, sorted(kept))
+
+
+class AxisStatsTestCase(SimpleTestCase):
+
+    def test_parse_bucket(self):
+        self.assertEqual(parse_bucket('30s'), timedelta(seconds=30))
+        self.assertEqual(parse_bucket('1h'), timedelta(hours=1))
+        self.assertIsNone(parse_bucket('0m'))
+        self.assertIsNone(parse_bucket('1 hour'))
+
+    def test_parse_percentiles(self):
+        self.assertEqual(parse_percentiles('50,99.5'), [0.5, 0.995])
+        self.assertIsNone(parse_percentiles('150'))
+        self.assertIsNone(parse_percentiles('median'))
+        self.assertEqual(percentile_name(0.995), 'p99.5')
+
+    def test_grouped_in_the_database(self):
+        queryset = AxisData.objects.values('axis_id', bucket=DateBin(timedelta(minutes=5), 'update_timestamp')).annotate(
+            velocity_percentiles=Percentiles('velocity', [0.5, 0.95]))
+        sql = str(queryset.query)
+        self.assertIn('date_bin(', sql)
+        self.assertIn('percentile_cont(ARRAY[0.5, 0.95]::float8[]) WITHIN GROUP (ORDER BY "axis_data"."velocity")', sql)
+        self.assertIn('GROUP BY', sql)
+
+
+class CountingViewSet(viewsets.ViewSet):
+    reads = 0
+
+    def list(self, request):
+        CountingViewSet.reads += 1
+        return Response([{'machine_id': 1}])
+
+
+class VersionedMachineViewSet(VersionedResponseMixin, CountingViewSet):
+    version_resources = ('test-machine',)
+
+
+class VersionedResponseTestCase(SimpleTestCase):
+
+    def setUp(self):
+        # a version no other test has cached a response for
+        versions.bump('test-machine')
+        CountingViewSet.reads = 0
+
+    def get(self, **headers):
+        request = APIRequestFactory().get('/data/machines/', **headers)
+        force_authenticate(request, user=User(username='operator'))
+        response = VersionedMachineViewSet.as_view({'get': 'list'})(request)
+        response.render()
+        return response
+
+    def test_not_modified_and_cached(self):
+        first = self.get()
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first['ETag']
+
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.get().data, [{'machine_id': 1}])
+        self.assertEqual(CountingViewSet.reads, 1)
+
+    def test_bump_changes_etag(self):
+        etag = self.get()['ETag']
+        versions.bump('test-machine')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class RoleCacheTestCase(SimpleTestCase):
+    # SimpleTestCase fails on any database query, cached roles must not need one
+
+    def cached_user(self, user_id, *roles):
+        role_cache.cache.set(role_cache._key(user_id), frozenset(roles))
+        return User(pk=user_id, username=f'user{user_id}')
+
+    def test_cached_roles(self):
+        user = self.cached_user(42, 'Manager')
+        self.assertTrue(role_cache.has_role(user, 'SUPERADMIN', 'Manager'))
+        self.assertFalse(role_cache.has_role(user, 'Operator'))
+
+    def test_membership_change_invalidates(self):
+        self.cached_user(43, 'Operator')
+        groups_changed(sender=None, instance=None, action='post_add', reverse=True, pk_set={43})
+        self.assertIsNone(role_cache.cache.get(role_cache._key(43)))
+
+    def test_group_change_invalidates_everyone(self):
+        self.cached_user(44, 'Operator')
+        role_cache.invalidate_all()
+        self.assertIsNone(role_cache.cache.get(role_cache._key(44)))
+
+
+class TokenCacheTestCase(SimpleTestCase):
+    # SimpleTestCase fails on any database query, a cached token must not need one
+
+    def access_token(self, token, user_id=7, seconds=3600):
+        user = User(pk=user_id, username=f'user{user_id}')
+        return user, AccessToken(token=token, user=user, scope='read write',
+                                 expires=datetime.now(timezone.utc) + timedelta(seconds=seconds))
+
+    def setUp(self):
+        token_cache.clear()
+
+    def test_authenticate_from_cache(self):
+        user, access_token = self.access_token('cached-token')
+        token_cache.set('cached-token', user, access_token)
+        request = Request(APIRequestFactory().get('/api/state/', HTTP_AUTHORIZATION='Bearer cached-token'))
+        authenticated_user, auth = CachedOAuth2Authentication().authenticate(request)
+        self.assertEqual(authenticated_user.pk, 7)
+        self.assertIsNot(authenticated_user, user)
+        self.assertTrue(auth.is_valid(['read']))
+
+    def test_expiry_and_max_age(self):
+        cache = TokenCache(size=10, max_age=60)
+        cache.set('expired', *self.access_token('expired', seconds=-1))
+        self.assertIsNone(cache.get('expired'))
+        cache.set('valid', *self.access_token('valid'))
+        self.assertLessEqual(cache.get('valid').expires_at, datetime.now(timezone.utc).timestamp() + 60)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_revocation_invalidates(self):
+        user, access_token = self.access_token('revoked-token')
+        token_cache.set('revoked-token', user, access_token)
+        access_token_changed(sender=AccessToken, instance=access_token)
+        self.assertIsNone(token_cache.get('revoked-token'))
+
+    def test_bounded(self):
+        cache = TokenCache(size=2, max_age=60)
+        for token in ('a', 'b', 'c'):
+            cache.set(token, *self.access_token(token))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 2)
+        cache.invalidate_user(7)
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class BulkRecordsTestCase(SimpleTestCase):
+    # rows are checked against the model fields and the topology registry, without a query
+
+    class AxisDataBulk(BulkCreateMixin):
+        bulk_fields = ('actual_position', 'target_position', 'homed', 'acceleration', 'velocity')
+        bulk_reference = 'axis_id'
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(registry, 'axis', lambda axis_id: (1, 'X') if axis_id == 7 else None),
+            mock.patch.object(registry, 'axis_id', lambda machine_id, axis_name: 7 if (machine_id, axis_name) == (1, 'X') else None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def row(self, **values):
+        return dict({'axis_id': 7, 'actual_position': 1.5, 'target_position': '2.25', 'homed': True,
+                     'acceleration': 0, 'velocity': 10}, **values)
+
+    def test_valid_rows(self):
+        rows = [self.row(update_timestamp='2024-01-02T03:04:05'), self.row(axis_id=None, machine_id=1, axis_name='X')]
+        columns, records, errors = self.AxisDataBulk().bulk_records(AxisData, rows)
+        self.assertEqual(errors, {})
+        self.assertEqual(columns, ['axis_id', 'actual_position', 'target_position', 'homed', 'acceleration', 'velocity', 'update_timestamp'])
+        self.assertEqual(records[0][:6], (7, Decimal('1.500'), Decimal('2.250'), True, Decimal('0.000'), Decimal('10.000')))
+        self.assertEqual(records[0][6], datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+        self.assertEqual(records[1][0], 7)
+
+    def test_invalid_rows(self):
+        rows = [self.row(), self.row(axis_id=8), self.row(velocity=10 ** 8, homed='maybe'), self.row(actual_position=None), 'row']
+        _, records, errors = self.AxisDataBulk().bulk_records(AxisData, rows)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(set(errors), {1, 2, 3, 4})
+        self.assertEqual(set(errors[2]), {'velocity', 'homed'})
+        self.assertEqual(errors[3], {'actual_position': ['this field is required']})
+
+    def test_keyed_rows_need_their_key(self):
+        columns, _, errors = self.AxisDataBulk().bulk_records(AxisData, [self.row()], keyed=True)
+        self.assertEqual(columns[1], 'axis_data_id')
+        self.assertEqual(errors, {0: {'axis_data_id': ['this field is required']}})
+
+
+class FleetPublisherTestCase(SimpleTestCase):
+    # the snapshot is read once per tick however many clients are connected, clients get the changes only
+
+    def fleet(self, velocity):
+        return {
+            'machine_data': [{'machine_id': 1, 'machine_name': '1', 'tool_capacity': 24}],
+            'tool_data': [{'machine_id': 1, 'tool_id': 3, 'tool_offset': 1.0, 'feedrate': 2.0,
+                           'update_timestamp': datetime(2024, 1, 2, tzinfo=timezone.utc)}],
+            'axis_data': [{'axis_id': 7, 'machine_id': 1, 'axis_name': 'X', 'velocity': velocity, 'homed': True},
+                          {'axis_id': 8, 'machine_id': 1, 'axis_name': 'Y', 'velocity': velocity, 'homed': True},
+                          {'axis_id': 9, 'machine_id': 2, 'axis_name': 'X', 'velocity': self.other_velocity, 'homed': True}],
+        }
+
+    def setUp(self):
+        self.reads = 0
+        self.velocity = Decimal('1.500')
+        self.other_velocity = Decimal('1.000')
+
+        def fleet_snapshot():
+            self.reads += 1
+            return self.fleet(self.velocity)
+
+        self.publisher = FleetPublisher(interval=60)
+        patches = [
+            mock.patch('user_management.publisher.fleet_snapshot', fleet_snapshot),
+            mock.patch('user_management.consumers.publisher', self.publisher),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def connect(self, query_string=b''):
+        # channels.testing needs daphne, the ASGI messages are exchanged directly
+        client = ApplicationCommunicator(MachineDataConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/ws/machine_data/', 'query_string': query_string, 'headers': []})
+        await client.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await client.receive_output())['type'], 'websocket.accept')
+        return client
+
+    async def receive(self, client):
+        return json.loads((await client.receive_output())['text'])
+
+    async def test_clients_share_one_read(self):
+        clients = [await self.connect() for _ in range(3)]
+        for client in clients:
+            snapshot = await self.receive(client)
+            self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 1))
+            self.assertEqual(snapshot['axis_data'][0]['velocity'], '1.500')
+
+        # nothing changed, nothing is sent
+        await self.publisher.publish()
+        self.velocity = Decimal('2.000')
+        await self.publisher.publish()
+        for client in clients:
+            self.assertEqual(await self.receive(client), {
+                'type': 'delta', 'seq': 2,
+                'axis_data': {'updated': [{'velocity': '2.000', 'axis_id': 7}, {'velocity': '2.000', 'axis_id': 8}], 'removed': []},
+            })
+            self.assertTrue(await client.receive_nothing())
+            await client.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await client.wait()
+        self.assertEqual(self.reads, 3)
+        self.assertEqual(supervisor.stats()['connections'], 0)
+
+    async def test_gap_sends_snapshot(self):
+        client = await self.connect()
+        await self.receive(client)
+        self.velocity = Decimal('2.000')
+        await self.publisher.read()
+        self.velocity = Decimal('3.000')
+        await self.publisher.publish()
+        # delta 2 never reached the client, it is sent a snapshot of seq 3 instead of delta 3
+        snapshot = await self.receive(client)
+        self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 3))
+        self.assertEqual(snapshot['axis_data'][0]['velocity'], '3.000')
+        await client.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await client.wait()
+
+    async def test_subscription(self):
+        client = await self.connect()
+        await self.receive(client)
+        await client.send_input({'type': 'websocket.receive', 'text': json.dumps(
+            {'type': 'subscribe', 'machine_ids': [1], 'axis_names': ['X'], 'fields': ['velocity']})})
+        snapshot = await self.receive(client)
+        self.assertEqual(snapshot['axis_data'], [{'axis_id': 7, 'velocity': '1.500'}])
+        self.assertEqual(snapshot['tool_data'], [{'machine_id': 1}])
+
+        # changes of unwatched machines only advance the sequence number
+        self.other_velocity = Decimal('5.000')
+        await self.publisher.publish()
+        self.assertEqual(await self.receive(client), {'type': 'delta', 'seq': 2})
+        self.velocity = Decimal('2.000')
+        await self.publisher.publish()
+        self.assertEqual(await self.receive(client), {
+            'type': 'delta', 'seq': 3, 'axis_data': {'updated': [{'velocity': '2.000', 'axis_id': 7}], 'removed': []},
+        })
+
+        await client.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'unsubscribe', 'axis_names': ['X']})})
+        self.assertEqual((await self.receive(client))['axis_data'], [])
+        await client.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await client.wait()
+
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    async def test_binary_frames_are_shared(self):
+        clients = [await self.connect(b'encoding=msgpack') for _ in range(2)]
+        frames = [(await client.receive_output())['bytes'] for client in clients]
+        self.assertIs(frames[0], frames[1])
+        snapshot = msgpack.unpackb(frames[0])
+        self.assertEqual((snapshot['type'], snapshot['axis_data'][0]['velocity']), ('snapshot', 1.5))
+        await clients[0].send_input({'type': 'websocket.receive', 'bytes': msgpack.packb({'type': 'resync'})})
+        self.assertEqual(msgpack.unpackb((await clients[0].receive_output())['bytes'])['type'], 'snapshot')
+        for client in clients:
+            await client.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await client.wait()
+
+    async def test_unknown_encoding(self):
+        client = await self.connect(b'encoding=xml')
+        self.assertEqual((await self.receive(client))['type'], 'error')
+        self.assertEqual((await client.receive_output())['code'], 4400)
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_json_does_not_depend_on_orjson(self):
+        message = {'type': 'snapshot', 'axis_data': [
+            {'velocity': Decimal('1.500'), 'update_timestamp': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc),
+             'naive': datetime(2024, 1, 2, 3, 4, 5, 123456), 'whole_second': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}]}
+        row = decode(encode(message, 'json'))['axis_data'][0]
+        self.assertEqual(row, decode(encode_json_stdlib(message))['axis_data'][0])
+        self.assertEqual((row['velocity'], row['update_timestamp']), ('1.500', '2024-01-02T03:04:05.123456Z'))
+
+    @unittest.skipIf(cbor2 is None or msgpack is None, "cbor2 or msgpack is not installed")
+    def test_cbor_matches_msgpack(self):
+        message = {'type': 'delta', 'axis_data': {'updated': [
+            {'velocity': Decimal('1.500'), 'update_timestamp': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}]}}
+        decoded = decode(encode(message, 'cbor'), 'cbor')
+        self.assertEqual(decoded, decode(encode(message, 'msgpack'), 'msgpack'))
+        self.assertEqual(decoded['axis_data']['updated'][0], {'velocity': 1.5, 'update_timestamp': '2024-01-02T03:04:05+00:00'})
+
+
+class TaskSupervisorTestCase(SimpleTestCase):
+
+    async def test_failures_are_contained(self):
+        tasks = TaskSupervisor()
+        tasks.register('client')
+
+        async def fail():
+            raise RuntimeError('boom')
+
+        with self.assertLogs('user_management.tasks', 'ERROR'):
+            failing = tasks.spawn('client', fail())
+            running = tasks.spawn('client', asyncio.sleep(60))
+            await asyncio.wait([failing], timeout=1)
+        self.assertFalse(running.done())
+        self.assertEqual(tasks.stats(), {'connections': 1, 'tasks': 1, 'started': 2, 'failed': 1, 'cancelled': 0})
+
+        tasks.unregister('client')
+        await asyncio.wait([running], timeout=1)
+        self.assertTrue(running.cancelled())
+        self.assertEqual(tasks.stats(), {'connections': 0, 'tasks': 0, 'started': 2, 'failed': 1, 'cancelled': 1})
+
+    async def test_lifespan_shutdown_cancels_tasks(self):
+        task = supervisor.spawn('publisher', asyncio.sleep(60))
+        messages = asyncio.Queue()
+        for message in ({'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}):
+            messages.put_nowait(message)
+        sent = []
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await LifespanApp()({'type': 'lifespan'}, messages.get, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(task.cancelled())
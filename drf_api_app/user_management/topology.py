@@ -0,0 +1,89 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Axis, Machine
+
+
+class TopologyRegistry:
+    """
+    In-process index of the machine / axis topology.
+
+    The machine and axis tables change rarely, so they are loaded once and kept in
+    memory keyed by (machine_id, axis_name). Views and the WebSocket consumer use it
+    to resolve axis ids and names without joining the axis table. Viewsets that
+    create, update or delete machines or axes call refresh(); max_age bounds how
+    stale another worker process can get.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._machines = {}          # machine_id -> machine row as a dict
+        self._axis_ids = {}          # (machine_id, axis_name) -> axis_id
+        self._axes = {}              # axis_id -> (machine_id, axis_name)
+        self._axes_by_machine = {}   # machine_id -> {axis_name: axis_id}
+
+    def refresh(self):
+        machines = {row['machine_id']: row for row in Machine.objects.values('machine_id', 'machine_name', 'tool_capacity')}
+        axis_ids = {}
+        axes_by_machine = {}
+        for axis_id, machine_id, axis_name in Axis.objects.values_list('axis_id', 'machine_id', 'axis_name'):
+            axis_ids[(machine_id, axis_name)] = axis_id
+            axes_by_machine.setdefault(machine_id, {})[axis_name] = axis_id
+
+        # swap everything at once so readers never see a half loaded registry
+        with self._lock:
+            self._machines = machines
+            self._axis_ids = axis_ids
+            self._axes = {axis_id: key for key, axis_id in axis_ids.items()}
+            self._axes_by_machine = axes_by_machine
+            self._loaded_at = time.monotonic()
+
+    def refresh_on_commit(self):
+        transaction.on_commit(self.refresh)
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or (self.max_age is not None and time.monotonic() - loaded_at > self.max_age):
+            self.refresh()
+
+    def machines(self):
+        self._ensure_loaded()
+        return list(self._machines.values())
+
+    def machine(self, machine_id):
+        self._ensure_loaded()
+        return self._machines.get(machine_id)
+
+    def axis_id(self, machine_id, axis_name):
+        self._ensure_loaded()
+        return self._axis_ids.get((machine_id, axis_name))
+
+    def axis(self, axis_id):
+        """Returns (machine_id, axis_name) for an axis id, or None."""
+        self._ensure_loaded()
+        return self._axes.get(axis_id)
+
+    def axis_ids(self, machine_id=None, axis_names=None):
+        """
+        Axis ids of one machine (or of all machines when machine_id is None),
+        optionally limited to the given axis names.
+        """
+        self._ensure_loaded()
+        if machine_id is None:
+            machines = self._axes_by_machine.values()
+        else:
+            machines = [self._axes_by_machine.get(machine_id, {})]
+        return [
+            axis_id
+            for axes in machines
+            for axis_name, axis_id in axes.items()
+            if not axis_names or axis_name in axis_names
+        ]
+
+
+registry = TopologyRegistry(max_age=getattr(settings, 'TOPOLOGY_MAX_AGE', 60))
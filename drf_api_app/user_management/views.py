@@ -3,6 +3,7 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import User, Group
 from .serializers import AddUserToGroupSerializer
 from rest_framework.permissions import IsAuthenticated
@@ -20,6 +21,27 @@ from rest_framework.response import Response
 from rest_framework import status
 from .models import AxisData, Axis, Machine
 from .serializers import AxisDataSerializer
+from .models import AxisState, ToolState, ToolUsageState
+from .serializers import AxisStateSerializer, ToolStateSerializer, ToolUsageStateSerializer, AxisDataRollupSerializer
+from .rollups import RESOLUTIONS, ROLLUP_FIELDS, choose_resolution, rollup_rows
+from .topology import registry
+from .bulk import BulkCreateMixin
+from .caching import VersionedResponseMixin, response_cache, versions
+from .authentication import token_cache
+from .publisher import publisher
+from .tasks import supervisor
+from .roles import role_cache
+from .encoders import AXIS_DATA_ROW, axis_data_rows, encode_axis_data_rows
+from .downsampling import METHODS, MIN_POINTS, SAMPLE_DTYPE, downsample_rows, series_indices
+from .stats import DEFAULT_PERCENTILES, GROUPS, axis_stats, parse_bucket, parse_percentiles
+from .filters import MachineFilterBackend, TimeRangeFilterBackend, parse_timestamp
+from .pagination import KeysetPagination
+from .export import EXPORT_FORMATS, async_chunks, export_chunks
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from .renderers import TABLE_RENDERERS, wants_columns
+import numpy as np
 
 class AddUserToGroupView(APIView):
     permission_classes = [IsAuthenticated]  # Only authenticated users can add others to groups
@@ -33,29 +55,30 @@ class AddUserToGroupView(APIView):
 
 
 
-# Define permissions for user groups
+# Define permissions for user groups, the groups of a user come from the role cache (roles.py)
 class IsSuperAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='SUPERADMIN').exists()
+        return role_cache.has_role(request.user, 'SUPERADMIN')
 
 class IsManager(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Manager').exists()
+        return role_cache.has_role(request.user, 'Manager')
 
 class IsSupervisor(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Supervisor').exists()
+        return role_cache.has_role(request.user, 'Supervisor')
 
 class IsOperator(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Operator').exists()
+        return role_cache.has_role(request.user, 'Operator')
 
 
 # Machine ViewSet
-class MachineViewSet(viewsets.ModelViewSet):
-    queryset = Machine.objects.all()
+class MachineViewSet(VersionedResponseMixin, viewsets.ModelViewSet):
+    queryset = Machine.objects.order_by('machine_id')
     serializer_class = MachineSerializer
     permission_classes = [permissions.IsAuthenticated]
+    version_resources = ('machine',)
 
     def get_permissions(self):
         if self.action == 'create':
@@ -66,14 +89,35 @@ class MachineViewSet(viewsets.ModelViewSet):
             return [IsSuperAdmin()]  
         return super().get_permissions()
 
+    # keep the in-memory topology and the response versions in step with the machine table
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        registry.refresh_on_commit()
+        versions.bump_on_commit('machine')
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        registry.refresh_on_commit()
+        versions.bump_on_commit('machine')
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        registry.refresh_on_commit()
+        # the axes of the machine are deleted with it
+        versions.bump_on_commit('machine', 'axis')
+
 # Tool ViewSet
-class ToolViewSet(viewsets.ModelViewSet):
+class ToolViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     queryset = Tool.objects.all()
     serializer_class = ToolSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # history table, listed newest first in pages
+    pagination_class = KeysetPagination
+    filter_backends = [TimeRangeFilterBackend, MachineFilterBackend]
+    bulk_fields = ('tool_offset', 'feedrate')
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return [IsSuperAdmin()] + [IsManager()] + [IsSupervisor()]  
         elif self.action == 'update':
             return [IsSuperAdmin()] + [IsManager()]  
@@ -82,13 +126,16 @@ class ToolViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
 # Tool Usage ViewSet
-class ToolUsageViewSet(viewsets.ModelViewSet):
+class ToolUsageViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     queryset = ToolUsage.objects.all()
     serializer_class = ToolUsageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [TimeRangeFilterBackend, MachineFilterBackend]
+    bulk_fields = ('tool_in_use',)
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return [IsSuperAdmin()] + [IsOperator()]  
         elif self.action == 'update':
             return [IsSuperAdmin()] + [IsManager()] + [IsOperator()]  
@@ -97,10 +144,11 @@ class ToolUsageViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
     
 # Axis ViewSet
-class AxisViewSet(viewsets.ModelViewSet):
-    queryset = Axis.objects.all()
+class AxisViewSet(VersionedResponseMixin, viewsets.ModelViewSet):
+    queryset = Axis.objects.order_by('axis_id')
     serializer_class = AxisSerializer
     permission_classes = [permissions.IsAuthenticated]
+    version_resources = ('axis',)
 
     def get_permissions(self):
         if self.action == 'create':
@@ -110,15 +158,38 @@ class AxisViewSet(viewsets.ModelViewSet):
         elif self.action == 'destroy':
             return [IsSuperAdmin()]  
         return super().get_permissions()
+
+    # keep the in-memory topology and the response versions in step with the axis table
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        registry.refresh_on_commit()
+        versions.bump_on_commit('axis')
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        registry.refresh_on_commit()
+        versions.bump_on_commit('axis')
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        registry.refresh_on_commit()
+        versions.bump_on_commit('axis')
     
 # Axis Data ViewSet
-class AxisDataViewSet(viewsets.ModelViewSet):
-    queryset = AxisData.objects.all()
+class AxisDataViewSet(BulkCreateMixin, viewsets.ModelViewSet):
+    # AxisDataSerializer reads the axis and machine names of every row
+    queryset = AxisData.objects.select_related('axis__machine')
     serializer_class = AxisDataSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [TimeRangeFilterBackend, MachineFilterBackend]
+    bulk_fields = ('actual_position', 'target_position', 'homed', 'acceleration', 'velocity')
+    bulk_reference = 'axis_id'
+    # axis_data is partitioned, its primary key includes the timestamp
+    bulk_unique_fields = ('update_timestamp',)
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return [IsSuperAdmin()] + [IsManager()] + [IsSupervisor()]  
         elif self.action == 'update':
             return [IsSuperAdmin()] + [IsManager()]  
@@ -129,43 +200,266 @@ class AxisDataViewSet(viewsets.ModelViewSet):
 
 
 class AxisDataLast15MinutesView(generics.ListAPIView):
+    """
+    Axis data of one machine, for the last 15 minutes or for ?start= / ?end= (ISO 8601).
+
+    ?resolution= selects raw rows (default), a rollup ('1s', '10s', '1m') or 'auto', which picks
+    the finest resolution that keeps each axis under AXIS_DATA_MAX_POINTS rows.
+    ?max_points= downsamples every axis to at most that many points, keeping the shape of
+    ?downsample_field= (actual_position by default) with ?downsample= lttb (default) or minmax.
+    For rollups the shape is taken from the average of the field, which has to be a rollup field.
+    Raw windows of more than AXIS_DATA_DOWNSAMPLE_MAX_SAMPLES samples are refused, they have to
+    be read from a rollup (?resolution=).
+    Besides row JSON the rows can be requested column oriented (see renderers.py).
+    """
     serializer_class = AxisDataSerializer
+    renderer_classes = TABLE_RENDERERS
+    default_window = timedelta(minutes=15)
+    downsample_fields = ['actual_position', 'target_position', 'distance_to_go', 'acceleration', 'velocity']
 
-    def get_queryset(self):
+    def get_axis_ids(self):
         machine_id = self.request.query_params.get('machine_id')
-        axis_name = self.request.query_params.get('axis_name')
-        axis_names = self.request.query_params.getlist('axis_name')  # If multiple axes are passed
-        
-        # Get the timestamp for 15 minutes ago
-        time_threshold = now() - timedelta(minutes=15)
+        axis_names = self.request.query_params.getlist('axis_name')  # one or more axes
+
+        # Resolve machine_id and axis names to axis ids from the topology registry instead of joining axis
+        try:
+            return registry.axis_ids(int(machine_id), axis_names)
+        except (TypeError, ValueError):
+            return []
+
+    def get_time_range(self):
+        # the last 15 minutes unless given, a start alone reaches up to now
+        start = parse_timestamp(self.request, 'start')
+        end = parse_timestamp(self.request, 'end') or now()
+        if start is None:
+            start = end - self.default_window
+        if start >= end:
+            raise ValidationError({"start": "must be before end"})
+        return start, end
+
+    def get_downsampling(self, fields):
+        """(max_points, method, field) of the query, all None when not downsampling."""
+        max_points = self.request.query_params.get('max_points')
+        if max_points is None:
+            return None, None, None
+        method = self.request.query_params.get('downsample', 'lttb')
+        if method not in METHODS:
+            raise ValidationError({"downsample": f"must be one of {', '.join(METHODS)}"})
+        field = self.request.query_params.get('downsample_field', 'actual_position')
+        if field not in fields:
+            raise ValidationError({"downsample_field": f"must be one of {', '.join(fields)}"})
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            max_points = 0
+        if max_points < MIN_POINTS[method]:
+            raise ValidationError({"max_points": f"must be an integer of at least {MIN_POINTS[method]} for {method}"})
+        return max_points, method, field
+
+    def check_raw_window(self, start, end):
+        # every sample of the window is read to downsample it, bounded by the number of samples
+        # the axes write in that time
+        samples = int((end - start).total_seconds() / settings.AXIS_DATA_SAMPLE_INTERVAL) * len(self.get_axis_ids())
+        if samples > settings.AXIS_DATA_DOWNSAMPLE_MAX_SAMPLES:
+            raise ValidationError({"max_points": (
+                f"the time range holds about {samples} raw samples, at most {settings.AXIS_DATA_DOWNSAMPLE_MAX_SAMPLES} "
+                f"are downsampled; use ?resolution=auto (or 1s, 10s, 1m) for this range")})
+
+    def get_queryset(self):
+        start, end = self.get_time_range()
         
-        # Filter based on machine_id and axis_name, and within the last 15 minutes
+        # Filter on the resolved axes, within the time range
         queryset = AxisData.objects.filter(
-            axis__machine__machine_id=machine_id,
-            update_timestamp__gte=time_threshold
+            axis_id__in=self.get_axis_ids(),
+            update_timestamp__gte=start,
+            update_timestamp__lt=end,
         )
 
-        # If a single axis name is provided
-        if axis_name:
-            queryset = queryset.filter(axis__axis_name=axis_name)
-        
-        # If multiple axis names are provided
-        if axis_names:
-            queryset = queryset.filter(axis__axis_name__in=axis_names)
-
         return queryset
 
-    def get(self, request, *args, **kwargs):
+    def get_rows(self, max_points, method, field):
+        encode = not wants_columns(self.request)
         queryset = self.get_queryset()
+        if max_points is None:
+            return axis_data_rows(queryset, encode=encode)
+
+        # only the id, time and value of the samples are read to pick the points, series by series
+        # in time order, the order the (axis_id, update_timestamp) index returns
+        samples = queryset.order_by('axis_id', 'update_timestamp').values_list('axis_id', 'axis_data_id', 'update_timestamp', field)
+        samples = np.fromiter(
+            ((axis_id, axis_data_id, timestamp.timestamp(), float(value)) for axis_id, axis_data_id, timestamp, value in samples.iterator(chunk_size=10000)),
+            dtype=SAMPLE_DTYPE)
+        kept = samples['id'][series_indices(samples['key'], samples['time'], samples['value'], max_points, method)]
+        if not len(kept):
+            return []
+        # then the whole rows of the kept points only
+        rows = queryset.filter(axis_data_id__in=kept.tolist()).order_by('axis_id', 'update_timestamp').values_list(*AXIS_DATA_ROW)
+        return list(encode_axis_data_rows(rows, encode=encode))
 
-        if not queryset.exists():
+    def get(self, request, *args, **kwargs):
+        resolution = request.query_params.get('resolution', 'raw')
+        if resolution not in RESOLUTIONS:
+            return Response({"detail": f"resolution must be one of {', '.join(RESOLUTIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        start, end = self.get_time_range()
+        if resolution == 'auto':
+            resolution = choose_resolution(end - start)
+
+        if resolution != 'raw':
+            max_points, method, field = self.get_downsampling(ROLLUP_FIELDS)
+            rows = rollup_rows(resolution, self.get_axis_ids(), start, end)
+            if max_points is not None:
+                rows = downsample_rows(rows, max_points, key_index='axis_id', time_index='bucket',
+                                       value_index=f'{field}_avg', method=method)
+            if not rows:
+                return Response({"detail": "No data found for the given parameters"}, status=status.HTTP_404_NOT_FOUND)
+            if wants_columns(request):
+                return Response(rows, status=status.HTTP_200_OK)
+            return Response(AxisDataRollupSerializer(rows, many=True).data, status=status.HTTP_200_OK)
+
+        downsampling = self.get_downsampling(self.downsample_fields)
+        if downsampling[0] is not None:
+            self.check_raw_window(start, end)
+        # an empty result is the not found case
+        rows = self.get_rows(*downsampling)
+        if not rows:
             return Response({"detail": "No data found for the given parameters"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(rows, status=status.HTTP_200_OK)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
 
+class AxisDataStatsView(APIView):
+    """
+    Min, max, mean, standard deviation and percentiles of velocity, acceleration and distance_to_go,
+    and the time homed, aggregated by PostgreSQL so only the statistics are sent.
 
-    
-    
+    ?group=axis (default), machine or fleet, ?bucket= width of the time buckets ('30s', '5m', '1h',
+    '1d', one bucket for the whole range when left out), ?percentiles=50,95 and the filters of the axis
+    data list (?start=, ?end=, default the last hour, ?machine_id=, ?axis_name=).
+    """
+    renderer_classes = TABLE_RENDERERS
+    default_window = timedelta(hours=1)
 
+    def get(self, request, *args, **kwargs):
+        group = request.query_params.get('group', 'axis')
+        if group not in GROUPS:
+            return Response({"detail": f"group must be one of {', '.join(GROUPS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        width = None
+        if 'bucket' in request.query_params:
+            width = parse_bucket(request.query_params['bucket'])
+            if width is None:
+                return Response({"detail": "bucket must be a width like 30s, 5m, 1h or 1d"}, status=status.HTTP_400_BAD_REQUEST)
+        percentiles = DEFAULT_PERCENTILES
+        if 'percentiles' in request.query_params:
+            percentiles = parse_percentiles(request.query_params['percentiles'])
+            if percentiles is None:
+                return Response({"detail": "percentiles must be numbers between 0 and 100, e.g. 50,95,99"}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = parse_timestamp(request, 'end') or now()
+        start = parse_timestamp(request, 'start') or end - self.default_window
+        if start >= end:
+            return Response({"detail": "start must be before end"}, status=status.HTTP_400_BAD_REQUEST)
+        if width is not None and (end - start) / width > settings.AXIS_DATA_STATS_MAX_BUCKETS:
+            return Response({"detail": f"at most {settings.AXIS_DATA_STATS_MAX_BUCKETS} buckets, use a wider bucket"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = AxisData.objects.filter(update_timestamp__gte=start, update_timestamp__lt=end)
+        queryset = MachineFilterBackend().filter_queryset(request, queryset, self)
+        return Response(axis_stats(queryset, width, group, percentiles), status=status.HTTP_200_OK)
+
+
+class AxisDataExportView(generics.GenericAPIView):
+    """
+    Raw axis data streamed as NDJSON (?output=ndjson, default) or CSV (?output=csv), gzip
+    compressed with ?compression=gzip. Takes the filters of the axis data list (?start=, ?end=,
+    ?machine_id=, ?axis_name=). Rows are ordered by axis and time, which the
+    (axis_id, update_timestamp) index returns without sorting, so the first rows are sent right away.
+    """
+    queryset = AxisData.objects.all()
+    filter_backends = [TimeRangeFilterBackend, MachineFilterBackend]
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({"detail": f"output must be one of {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        compression = request.query_params.get('compression')
+        if compression not in (None, 'gzip'):
+            return Response({"detail": "compression must be gzip"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by('axis_id', 'update_timestamp')
+        chunks = export_chunks(queryset, output, gzip=compression == 'gzip', chunk_size=settings.AXIS_DATA_EXPORT_CHUNK_SIZE)
+        if isinstance(request._request, ASGIRequest):
+            chunks = async_chunks(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="axis_data.{output}"'
+        if compression == 'gzip':
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
+AXIS_STATE_VALUES = ['axis_data_id', 'actual_position', 'target_position', 'distance_to_go', 'homed', 'acceleration', 'velocity', 'update_timestamp']
+
+
+class FleetStateView(APIView):
+    """
+    Latest axis, tool and tool usage values of every machine (or of one machine with ?machine_id=),
+    read from the state tables so the cost does not grow with the history. ?table= returns one of
+    the three tables only, which the Arrow output needs.
+    """
+    renderer_classes = TABLE_RENDERERS
+    serializers = {
+        'axis_state': AxisStateSerializer,
+        'tool_state': ToolStateSerializer,
+        'tool_usage_state': ToolUsageStateSerializer,
+    }
+
+    def table_rows(self, name, queryset):
+        if not wants_columns(self.request):
+            return self.serializers[name](queryset, many=True).data
+        # plain values for the columnar renderers, axis names from the registry like AxisStateSerializer
+        if name == 'axis_state':
+            return [
+                dict(zip(('machine_id', 'axis_name'), registry.axis(row['axis']) or (None, None)), **row)
+                for row in queryset.values('axis', *AXIS_STATE_VALUES)
+            ]
+        return list(queryset.values())
+
+    def get(self, request, *args, **kwargs):
+        table = request.query_params.get('table')
+        if table is not None and table not in self.serializers:
+            return Response({"detail": f"table must be one of {', '.join(self.serializers)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if table is None and request.accepted_renderer.format == 'arrow':
+            return Response({"detail": "arrow output needs ?table="}, status=status.HTTP_400_BAD_REQUEST)
+
+        querysets = {
+            'axis_state': AxisState.objects.all(),
+            'tool_state': ToolState.objects.all(),
+            'tool_usage_state': ToolUsageState.objects.all(),
+        }
+
+        machine_id = request.query_params.get('machine_id')
+        if machine_id is not None:
+            try:
+                machine_id = int(machine_id)
+            except ValueError:
+                return Response({"detail": "machine_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+            querysets['axis_state'] = querysets['axis_state'].filter(axis_id__in=registry.axis_ids(machine_id))
+            querysets['tool_state'] = querysets['tool_state'].filter(machine_id=machine_id)
+            querysets['tool_usage_state'] = querysets['tool_usage_state'].filter(machine_id=machine_id)
+
+        if table is not None:
+            return Response(self.table_rows(table, querysets[table]), status=status.HTTP_200_OK)
+        return Response({name: self.table_rows(name, queryset) for name, queryset in querysets.items()},
+                        status=status.HTTP_200_OK)
+
+
+class ServiceStatsView(APIView):
+    """
+    Hit and miss counters of the in-process caches, and the live WebSocket connections and
+    background tasks, of the worker answering the request.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'token_cache': token_cache.stats(),
+            'response_cache': response_cache.stats(),
+            'websocket': dict(supervisor.stats(), subscribers=publisher.subscribers, seq=publisher.seq),
+        }, status=status.HTTP_200_OK)